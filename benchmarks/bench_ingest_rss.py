@@ -0,0 +1,76 @@
+
+#
+# Peak RSS of reading an export with readlines() + join + json.loads
+# (the original main()) versus the streaming reader in qc1np.ingest.
+#
+# Every measurement runs in a fresh interpreter so ru_maxrss only covers
+# that single read.
+#
+# Usage:
+#
+#   $ python3 benchmarks/bench_ingest_rss.py [count ...]
+#
+
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from synthetic_export import write_export  # noqa: E402
+
+DEFAULT_COUNTS = [1000, 5000, 20000]
+
+CHILD = r'''
+import json
+import resource
+import sys
+
+mode, filepath = sys.argv[1:]
+count = 0
+with open(filepath) as infile:
+    if mode == 'readlines':
+        for record in json.loads(''.join(infile.readlines())):
+            count += 1
+    else:
+        from qc1np.ingest import iter_records
+        for record in iter_records(infile):
+            count += 1
+print(count, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def measure(mode, filepath):
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD, mode, filepath],
+        cwd=ROOT,
+        text=True,
+    )
+    count, maxrss = output.split()
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return int(count), int(maxrss) / divisor
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or DEFAULT_COUNTS
+
+    print('%10s %12s %16s %16s' % ('records', 'export MiB', 'readlines MiB', 'streaming MiB'))
+    for count in counts:
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as outfile:
+            write_export(outfile, count)
+            filepath = outfile.name
+        try:
+            size = os.path.getsize(filepath) / (1024 * 1024)
+            _, baseline = measure('readlines', filepath)
+            _, streaming = measure('stream', filepath)
+            print('%10d %12.1f %16.1f %16.1f' % (count, size, baseline, streaming))
+        finally:
+            os.remove(filepath)
+
+
+if __name__ == '__main__':
+    main()
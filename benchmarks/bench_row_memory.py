@@ -0,0 +1,77 @@
+#
+# Memory of the parsed rows kept by the writers: the dicts built by
+# transform_record() versus the compact rows of qc1np.rows.
+#
+# The records of a synthetic export are transformed once; the table
+# shows, per file, the bytes of the containers of all rows (the values
+# themselves are shared by both) and the traced memory of keeping all
+# rows as dicts or as compact rows.
+#
+# Usage:
+#
+#   $ python3 benchmarks/bench_row_memory.py [count]
+#
+
+import gc
+import importlib.util
+import os
+import sys
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from qc1np.rows import RowCompactor  # noqa: E402
+from synthetic_export import generate  # noqa: E402
+
+DEFAULT_COUNT = 100000
+
+
+def load_script():
+    path = os.path.join(ROOT, 'hotfix-1np-responses-20210317.py')
+    spec = importlib.util.spec_from_file_location('hotfix', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT
+    script = load_script()
+    compact = RowCompactor()
+
+    tracemalloc.start()
+    rows = []
+    for record in generate(count):
+        parsed_record, _, _ = script.transform_record(record)
+        file_key = '%s-%s' % (parsed_record['response_type'], parsed_record['activity'])
+        parsed_record['submission_index'] = 1
+        parsed_record['Participant_NR'] = 1
+        rows.append((file_key, parsed_record))
+    gc.collect()
+    as_dicts = tracemalloc.get_traced_memory()[0]
+
+    compact_rows = [(file_key, compact(file_key, row)) for file_key, row in rows]
+    sizes = {}
+    for (file_key, row), (_, compact_row) in zip(rows, compact_rows):
+        size = sizes.setdefault(file_key, [0, 0, 0])
+        size[0] += 1
+        size[1] += sys.getsizeof(row)
+        size[2] += sys.getsizeof(compact_row)
+    del rows
+    gc.collect()
+    as_rows = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    mib = 1024 * 1024
+    print('%-28s %8s %14s %14s' % ('file', 'rows', 'dicts MiB', 'rows MiB'))
+    for file_key in sorted(sizes):
+        records, dicts, compacts = sizes[file_key]
+        print('%-28s %8d %14.1f %14.1f' % (file_key, records, dicts / mib, compacts / mib))
+    print()
+    print('all rows kept, traced MiB: dicts %.1f, compact rows %.1f' % (as_dicts / mib, as_rows / mib))
+
+
+if __name__ == '__main__':
+    main()
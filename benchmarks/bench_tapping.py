@@ -0,0 +1,84 @@
+#
+# Re-scoring tapping sessions: TapScore a session and a tap at a time, as
+# _process_task_tapping does, versus qc1np.tapping.score_taps() on the
+# flat arrays of all sessions.
+#
+# The sessions come from a synthetic export and are decoded beforehand;
+# "arrays" is the time to build the flat arrays from the decoded taps
+# (description codes and parsed times), "score_taps" that of the single
+# vectorized call.
+#
+# Usage:
+#
+#   $ python3 benchmarks/bench_tapping.py [sessions]
+#
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from qc1np.tapping import encode_descriptions, score_taps  # noqa: E402
+from qc1np.transform import TapScore  # noqa: E402
+from synthetic_export import generate  # noqa: E402
+
+DEFAULT_SESSIONS = 20000
+
+
+def per_session(sessions):
+    for interactions in sessions:
+        score = TapScore()
+        for interaction in interactions:
+            score.add(interaction['description'], interaction.get('time'))
+        dict(score.columns())
+
+
+def arrays(sessions):
+    offsets = np.zeros(len(sessions) + 1, dtype=np.int64)
+    np.cumsum([len(interactions) for interactions in sessions], out=offsets[1:])
+    taps = [interaction for interactions in sessions for interaction in interactions]
+    codes, hands = encode_descriptions([tap.get('description') for tap in taps])
+    times = pd.to_datetime(
+        pd.Series([tap.get('time') for tap in taps], dtype=object),
+        utc=True, format='ISO8601', errors='coerce',
+    )
+    return offsets, codes, hands, times.dt.tz_localize(None).to_numpy('datetime64[us]')
+
+
+def measure(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SESSIONS
+
+    sessions = []
+    for record in generate(count * 12, health_blocks=1):
+        data = json.loads(record['data'])
+        if 'at_tapping' in data['results']:
+            sessions.append(data['results']['at_tapping']['interactions'])
+            if len(sessions) == count:
+                break
+    taps = sum(len(interactions) for interactions in sessions)
+
+    loop, _ = measure(per_session, sessions)
+    build, flat = measure(arrays, sessions)
+    batch, _ = measure(score_taps, *flat)
+
+    print('%d sessions, %d taps' % (len(sessions), taps))
+    print('%-12s %10s %14s' % ('', 'seconds', 'us/session'))
+    for name, seconds in [('TapScore', loop), ('arrays', build), ('score_taps', batch)]:
+        print('%-12s %10.3f %14.2f' % (name, seconds, seconds / len(sessions) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#
+# Cost per health data block of parsing its timestamps, before and
+# after qc1np.timestamps:
+#
+#   fromisoformat    every use parses again, as _process_healthdata and
+#                    HealthPerDay did (dateFrom and dateTo three times
+#                    each per block)
+#   parse_timestamp  _process_healthdata parses each string once and
+#                    HealthPerDay looks it up again in the LRU cache
+#
+# "overlapping" repeats the blocks of the previous upload in every
+# upload, as the app does when it re-sends the last days.
+#
+# Usage:
+#
+#   $ python3 benchmarks/bench_timestamps.py [uploads]
+#
+
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from qc1np.timestamps import epoch, parse_timestamp  # noqa: E402
+from synthetic_export import generate  # noqa: E402
+
+
+def before(uploads):
+    for blocks in uploads:
+        for block in blocks:
+            for _ in range(3):
+                datetime.fromisoformat(block['dateFrom']).timestamp()
+                datetime.fromisoformat(block['dateTo']).timestamp()
+
+
+def after(uploads):
+    for blocks in uploads:
+        for block in blocks:
+            parse_timestamp(block['dateFrom']).epoch
+            parse_timestamp(block['dateTo']).epoch
+            epoch(block['dateFrom'])
+            epoch(block['dateTo'])
+
+
+def measure(function, uploads):
+    best = None
+    for _ in range(3):
+        parse_timestamp.cache_clear()
+        started = time.perf_counter()
+        function(uploads)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    distinct = []
+    for record in generate(count * 20):
+        if record['response_type'] == 3:
+            distinct.append(json.loads(record['data'])['results'])
+        if len(distinct) == count:
+            break
+    overlapping = [distinct[i - 1] + blocks if i else blocks for i, blocks in enumerate(distinct)]
+
+    print('%-12s %8s %18s %18s' % ('uploads', 'blocks', 'fromisoformat us', 'parse_timestamp us'))
+    for name, uploads in [('distinct', distinct), ('overlapping', overlapping)]:
+        blocks = sum(len(upload) for upload in uploads)
+        print('%-12s %8d %18.2f %18.2f' % (
+            name,
+            blocks,
+            measure(before, uploads) / blocks * 1e6,
+            measure(after, uploads) / blocks * 1e6,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+
+#
+# Generates a synthetic Orchestra export in the 1nP pilot format for
+# the benchmarks in this directory. The records mimic the shape of the
+# real exports (nested JSON strings for study, metadata and data) but
+# all values are made up.
+#
+# Usage:
+#
+#   $ python3 benchmarks/synthetic_export.py 10000 > synthetic-10000.json
+#
+
+import json
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+COLORS = ['Green', 'Red', 'Yellow', 'Blue']
+
+STUDY = json.dumps({
+    'short_name': '1nP',
+    'version': 3,
+    'name': 'One n Pilot',
+    'description': 'Synthetic study used for benchmarking.',
+})
+
+QUESTIONNAIRES = {
+    'qes_gad7': ['question1', 'question9', 'question8', 'question7', 'question6', 'question5', 'question4'],
+    'qes_phq9': ['question1', 'question8', 'question7', 'question6', 'question5', 'question4', 'question3',
+                 'question2', 'question9', 'question10'],
+    'qes_panas10': ['question2', 'question1'] + ['question%d' % i for i in range(3, 21)],
+}
+
+ANSWERS = {
+    'qes_gad7': ['Not at all', 'Several days', 'More than half the days', 'Nearly every day'],
+    'qes_phq9': ['Not at all', 'Several days', 'More than half the days', 'Nearly every day'],
+    'qes_panas10': ['Very Slightly or Not at All', 'A Little', 'Moderately', 'Quite a Bit', 'Extremely  '],
+}
+
+DIFFICULTY = ['Not difficult at all', 'Somewhat difficult', 'Very difficult', 'Extremely difficult']
+
+TIMEZONES = ['Europe/Amsterdam', 'Europe/London', 'America/New_York']
+
+# Relative weight of each activity in the generated export.
+ACTIVITIES = [
+    ('questionnaire', 'qes_gad7', 2),
+    ('questionnaire', 'qes_phq9', 2),
+    ('questionnaire', 'qes_panas10', 2),
+    ('task', 'at_stroopeffect', 3),
+    ('task', 'at_tapping', 3),
+    ('healthdata', None, 1),
+]
+
+RESPONSE_TYPE_IDS = {
+    'questionnaire': 1,
+    'task': 2,
+    'healthdata': 3,
+}
+
+
+def generate(count, seed=0, participants=50, health_blocks=200):
+    """Yield ``count`` synthetic response records."""
+    rng = random.Random(seed)
+    # The response ids are UUIDs, as in the real exports; drawn from a
+    # generator of their own so they leave the other values as they were.
+    ids = random.Random('ids-%d' % seed)
+    choices = [(rtype, activity) for rtype, activity, weight in ACTIVITIES for _ in range(weight)]
+    pids = ['%08x-0000-4000-8000-%012x' % (rng.getrandbits(32), i) for i in range(participants)]
+    tzs = {pid: rng.choice(TIMEZONES) for pid in pids}
+    base = datetime(2021, 3, 17, 8, 0, tzinfo=timezone.utc)
+
+    for idx in range(count):
+        rtype, activity = rng.choice(choices)
+        pid = rng.choice(pids)
+        start = base + timedelta(seconds=idx * 97 + rng.randint(0, 90))
+
+        if rtype == 'questionnaire':
+            results = _questionnaire(rng, activity)
+        elif activity == 'at_stroopeffect':
+            results = {'at_stroopeffect': {'interactions': _stroop(rng, start)}}
+        elif activity == 'at_tapping':
+            results = {'at_tapping': {'interactions': _tapping(rng, start)}}
+        else:
+            results = _healthdata(rng, start, health_blocks)
+
+        metadata = {
+            'activity': {'short_name': activity, 'name': activity} if activity else None,
+            'app': {
+                'version': '1.4.2',
+                'build': '118',
+                'device': {'tz': tzs[pid], 'os': 'iOS', 'model': 'iPhone12,1'},
+            },
+        }
+        data = {
+            'timestamps': {
+                'start': start.isoformat(),
+                'end': (start + timedelta(minutes=2)).isoformat(),
+                'scheduled_start': start.replace(hour=0, minute=0, second=0).isoformat(),
+                'scheduled_end': start.replace(hour=23, minute=59, second=59).isoformat(),
+                'submitted': (start + timedelta(minutes=2, seconds=3)).isoformat(),
+            },
+            'results': results,
+        }
+        yield {
+            'id': str(uuid.UUID(int=ids.getrandbits(128), version=4)),
+            'participant_id': pid,
+            'response_type': RESPONSE_TYPE_IDS[rtype],
+            'study': STUDY,
+            'metadata': json.dumps(metadata),
+            'data': json.dumps(data),
+            'created_at': (start + timedelta(minutes=3)).isoformat(),
+        }
+
+
+def write_export(outfile, count, **kwargs):
+    """Write an export of ``count`` records to ``outfile`` one record at a time."""
+    outfile.write('[\n')
+    for idx, record in enumerate(generate(count, **kwargs)):
+        if idx:
+            outfile.write(',\n')
+        json.dump(record, outfile)
+    outfile.write('\n]\n')
+
+
+def _answer(text):
+    return {'results': {'answer': [{'text': text}]}}
+
+
+def _questionnaire(rng, activity):
+    questions = QUESTIONNAIRES[activity]
+    answers = ANSWERS[activity]
+    results = {'Questions': {'results': {}}}
+    for question in questions:
+        if activity == 'qes_phq9' and question == 'question10':
+            results['Questions 2'] = {'results': {question: _answer(rng.choice(DIFFICULTY))}}
+        else:
+            results['Questions']['results'][question] = _answer(rng.choice(answers))
+    return results
+
+
+def _stroop(rng, start):
+    interactions = []
+    moment = start
+    for idx in range(rng.randint(26, 34)):
+        moment += timedelta(milliseconds=rng.randint(400, 2500))
+        color = rng.choice(COLORS)
+        spelling = color if rng.random() < 0.5 else rng.choice(COLORS)
+        interactions.append({
+            'time': moment.isoformat(),
+            'correctness': 'Correct gesture' if rng.random() < 0.9 else 'Wrong gesture',
+            'description': 'Word shown in %s with spelling %s, total words %d' % (color, spelling, idx + 1),
+        })
+    return interactions
+
+
+def _tapping(rng, start):
+    interactions = []
+    moment = start
+    hand = 'right'
+    for _ in range(rng.randint(40, 120)):
+        moment += timedelta(milliseconds=rng.randint(120, 600))
+        if rng.random() < 0.85:
+            hand = 'left' if hand == 'right' else 'right'
+        interactions.append({
+            'time': moment.isoformat(),
+            'description': 'Tapped %s button' % hand,
+        })
+    return interactions
+
+
+def _healthdata(rng, start, blocks):
+    results = []
+    moment = start - timedelta(days=2)
+    for _ in range(rng.randint(blocks // 2, blocks)):
+        moment += timedelta(minutes=rng.randint(5, 30))
+        duration = timedelta(minutes=rng.randint(1, 20))
+        results.append({
+            'type': 'HealthDataType.STEPS',
+            'value': float(rng.randint(0, 900)),
+            'unit': 'COUNT',
+            'dateFrom': moment.isoformat(),
+            'dateTo': (moment + duration).isoformat(),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    write_export(sys.stdout, int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
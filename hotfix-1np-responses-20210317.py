@@ -7,6 +7,41 @@
 # BIG NOTE: the script looks into the JSON input to determine
 # the correct active task. No arguments are required.
 #
+# Health data responses also add their sums per day to
+# qc-responses-1nP-healthdata-daily.csv, one row per type and date.
+# qc-responses-1nP-healthdata-per-day.csv sums the distinct blocks of
+# all responses per participant, type and date.
+#
+# Stroop responses write their interactions, as many as a session has, to
+# qc-responses-1nP-task-at_stroopeffect-interactions.csv, one row each;
+# qc1np.stroop.wide_view() gives the Inter<i>_* columns per session. The
+# scores of a session (congruent/incongruent totals, percentages and mean
+# times) are computed while its interactions are read and written with
+# the session.
+#
+# The records are transformed by qc1np.transform, where every activity
+# has a processor registered for it with @register() (qc1np.processors);
+# a new activity only needs a processor. The run ends with the number of
+# records and the time per processor.
+#
+# With --workers N the records are transformed by N processes; the
+# output is identical to a run with a single process.
+#
+# With --state PATH only the records created since the previous run
+# with the same state file are processed and appended to the CSV files;
+# the digests of the health data blocks counted go to PATH.health-blocks.
+#
+# With --activities NAMES only the responses of those activities (short
+# names, e.g. at_tapping,qes_gad7; 'all' for the health data) are
+# transformed. The data of the other responses is never decoded.
+#
+# With --parquet every CSV file also gets a typed Parquet dataset
+# (qc-responses-1nP-<activity>.parquet) for the notebook.
+#
+# Every row gets the Participant_NR of its participant from the registry
+# in ppt_id_to_ppt_nr.jsonl (--participants PATH), which the notebook
+# shares.
+#
 # NOTE: This script is written for the response format used for
 # the 1nP pilot and makes assumptions about field names and values
 # as of 2021-03-17.
@@ -24,31 +59,36 @@
 #
 #   $ python3 hotfix-1np-responses-20210317.py < qc-service_response-1np-alldata-20210412.json
 #
+#       OR
+#
+#   $ python3 hotfix-1np-responses-20210317.py --workers 8 qc-service_response-1np-alldata-20210412.json
+#
+#       OR
+#
+#   $ python3 hotfix-1np-responses-20210317.py --state qc-responses-1nP-state.json qc-service_response-1np-alldata-20210413.json
+#
+#       OR
+#
+#   $ python3 hotfix-1np-responses-20210317.py --activities at_tapping,at_stroopeffect qc-service_response-1np-alldata-20210413.json
+#
 #
 
-import csv
-import json
+import argparse
+import multiprocessing
 import os
 import sys
-import traceback
-from datetime import datetime
-import pandas as pd
-import re
-
-# The CSV should quote all non-numeric fields and escape the
-# delimiter when it appears inside a quoted field.
-CSVARGS = {
-    'strict': True,
-    'quotechar': '"',
-    'delimiter': ',',
-    'quoting': csv.QUOTE_ALL,
-    'doublequote': False,
-    'escapechar': '\\',
-    'skipinitialspace': True,
-}
-
-PYTHON_FILE = sys.argv.pop(0)
-HAS_FILE = (len(sys.argv) > 0)
+from collections import deque
+from contextlib import ExitStack
+
+from qc1np.health import HealthPerDay
+from qc1np.indexing import SubmissionIndex, renumber_csv
+from qc1np.ingest import iter_records, select_activities
+from qc1np.participants import REGISTRY_PATH, ParticipantRegistry
+from qc1np.processors import ProcessorStats
+from qc1np.rows import RowCompactor, UnexpectedFields
+from qc1np.state import RunState, StateError
+from qc1np.transform import cache_stats, elog, per_day_rows, record_rows, transform_record
+from qc1np.writers import CsvWriterPool
 
 # The maxiumum number of taps that are physically possible. We use
 # this to create a fixed length set of column names.
@@ -60,422 +100,234 @@ MAX_UNITS_PER_SAMPLE = os.getenv('MAX_UNITS_PER_SAMPLE', 20)
 # Determines whether to include the complete JSON record at the end of the row.
 INCLUDE_JSON = os.getenv('INCLUDE_JSON', False)
 
-RESPONSE_TYPES = {
-    1: 'questionnaire',
-    2: 'task',
-    3: 'healthdata',
-}
+# Number of records handed to a worker at a time with --workers. Large
+# enough to amortise the inter-process overhead, small enough to keep
+# the records in flight (2 chunks per worker) cheap.
+WORKER_CHUNK_SIZE = int(os.getenv('WORKER_CHUNK_SIZE', 256))
 
 def main():
-    input_data = None
+    args = _parse_args()
+
+    state = None
+    if args.state:
+        try:
+            state = RunState(args.state)
+            state.recover(log=elog, parquet=args.parquet)
+        except StateError as ex:
+            elog(ex)
+            sys.exit(1)
+
+    participants = ParticipantRegistry(args.participants)
 
     # Read in a JSON export from the Orchestra, either by file or STDIN.
-    if HAS_FILE:
-        filepath = sys.argv[0]
+    # The records are decoded one at a time from the top-level array so
+    # the export is never held in memory as a whole. If the data is
+    # malformed in any way, execution will halt.
+    if args.input:
+        filepath = args.input
         elog('Reading file %s' % filepath)
         with open(filepath) as infile:
-            input_data = infile.readlines()
+            _process_records(iter_records(infile), participants, args.workers, state, args.parquet, args.activities)
 
     else:
         elog('Reading from STDIN')
-        input_data = sys.stdin.readlines()
-
-    # Basic input checking
-    is_list = (type(input_data) == list)
-    if is_list:
-        input_data = ''.join(input_data)
-    else:
-        # elog('Input data is not a list (%s)' % is_list)
-        sys.exit(1)
-
-    # Convert text input to a proper JSON object.
-    # If the data is malformed in any way, execution will halt.
-    response_records = json.loads(input_data)
-    record_count = len(response_records)
+        _process_records(iter_records(sys.stdin), participants, args.workers, state, args.parquet, args.activities)
 
-    elog('Processing %s records' % record_count)
 
-    # Process each response record
-    skipped = 0
-    common_column_names = []
-    participant_responses = {}
-    output_data = {}
-
-    # The pattern can be compiled before looping over each record. This
-    # is a small but not-insignificant performance improvement and is
-    # easier to catch exceptions here vs during a match.
-    pattern = re.compile(
-        r"""^.+(Green|Red|Yellow|Blue).+(Green|Red|Yellow|Blue).+\s(\d+)\s*$""",
-        re.IGNORECASE
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description='Convert a 1nP Orchestra export into one CSV file per activity.',
     )
-
-    for idx, record in enumerate(response_records):
-        first_record = (idx == 0)
-        if first_record:
-            common_column_names = list(record.keys())
-            dlog('Input fields: %s' % ', '.join(common_column_names))
-
-        pid = record['participant_id']
-        rtype = RESPONSE_TYPES[int(record['response_type'])]
-        parsed_record = {
-            'id': record['id'],
-            'participant': pid,
-            'response_type': rtype,
-        }
-
-        try:
-            if 'study' in record:
-                study = json.loads(record['study'])
-                parsed_record['study'] = study['short_name']
-                parsed_record['study_version'] = study['version']
-
-        except Exception as ex:
-            traceback.print_exc()
-            # elog('%s\n' % study)
-            skipped += 1
-            next
-
+    parser.add_argument(
+        'input',
+        nargs='?',
+        help='JSON export to read (default: STDIN)',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        metavar='N',
+        help='transform the records in N processes (default: 1)',
+    )
+    parser.add_argument(
+        '--state',
+        metavar='PATH',
+        help='only process records created since the run that saved PATH '
+             'and append them to the existing CSV files',
+    )
+    parser.add_argument(
+        '--parquet',
+        action='store_true',
+        help='also write a typed Parquet dataset per CSV file (requires pyarrow)',
+    )
+    parser.add_argument(
+        '--participants',
+        default=REGISTRY_PATH,
+        metavar='PATH',
+        help='participant registry to number the participants with '
+             '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--activities',
+        type=lambda names: [name.strip() for name in names.split(',') if name.strip()],
+        metavar='NAMES',
+        help='only transform the responses of these activities (short names, '
+             'comma separated; "all" for the health data)',
+    )
+    args = parser.parse_args()
+    if args.activities is not None and args.state:
+        # The state would mark the responses of the other activities as
+        # processed, so a later run would never write them.
+        parser.error('--activities cannot be combined with --state')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.parquet:
         try:
-            if 'metadata' in record:
-                metadata = json.loads(record['metadata'])
-                if 'activity' in metadata and metadata['activity'] is not None:
-                    parsed_record['activity'] = metadata['activity']['short_name']
-                else:
-                    # This is used in the file name for this response type +
-                    # activity combo so we give this a sensible value
-                    # so it looks reasonable as demo output.
-                    parsed_record['activity'] = 'all'
-                if 'app' in metadata:
-                    parsed_record['app_version'] = '%s - %s' % (
-                        metadata['app']['version'],
-                        metadata['app']['build'],
-                    )
-                    parsed_record['timezone'] = metadata['app']['device']['tz']
-
-        except Exception as ex:
-            elog(ex)
-            traceback.print_exc()
-            # elog('%s\n' % metadata)
-            skipped += 1
-            next
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error('--parquet requires pyarrow')
+    return args
 
-        # Add the submitted date as recorded by the database after the metadata
-        # and before the data which includes dates at the start.
-        parsed_record['received_at'] = record['created_at']
-
-        try:
-            if 'data' in record:
-                data = json.loads(record['data'])
-                if 'questionnaire' in rtype:
-                    activity_type = metadata["activity"]["short_name"]
-                    if activity_type == "qes_intake":
-                        _process_intake(data, parsed_record)
-                    elif activity_type == "qes_final":
-                        print("Not supported")
-                    else:
-                        _process_mood_questionnaires(data, parsed_record, activity_type)
-                elif 'task' in rtype:
-                    activity_type = metadata["activity"]["short_name"]
-                    if activity_type == 'at_stroopeffect':
-                        _process_task_stroop(data, parsed_record, pattern)
-                    elif activity_type == 'at_tapping':
-                        _process_task_tapping(data, parsed_record)
-                elif 'healthdata' in rtype:
-                    _process_healthdata(data, parsed_record)
-                else:
-                    elog('Unexpected response type (%s)' % rtype)
-
-        except Exception as ex:
-            traceback.print_exc()   
-            # elog('%s\n' % data)
-            # elog()
-            skipped += 1
-            next
-
-        file_key = '%s-%s' % (
-            parsed_record['response_type'],
-            parsed_record['activity'],
-        )
-        if file_key not in output_data:
-            output_data[file_key] = []
-
-        # Keep track of the number of times the participant
-        # has completed this activity.
-        submission_key = '%s:%s' % (pid, file_key)
-        if submission_key not in participant_responses:
-            participant_responses[submission_key] = 0
-        participant_responses[submission_key] += 1
-        parsed_record['submission_index'] = participant_responses[submission_key]
-
-        output_data[file_key].append(parsed_record)
-
-    output_files = list(output_data.keys())
-
-    for idx, output_file in enumerate(output_files):
-        filename = 'qc-responses-1nP-%s.csv' % output_file
-        elog('\nWriting file (%d) %s' % (idx+1, filename))
-        output_records = output_data[output_file]
-        column_names = list(output_records[0].keys())
-        dlog('  -> %s' % ', '.join(column_names))
-
-        # Create a new file and file handle for each dataset
-        with open(filename, 'w', newline='') as csvfile:
-            ghostwriter = csv.writer(
-                csvfile,
-                **CSVARGS
-            )
-
-            # Actually write the CSV content to the file handle
-            # starting with the header row followed by the data.
-            ghostwriter.writerow(column_names)
-            for response in output_records:
-                ghostwriter.writerow(response.values())
-
-    args = (record_count-skipped, record_count, skipped)
-    # elog('\n\nTransformed %d out of %d records (%d skipped)' % args)
-
-
-def elog(*args, **kwargs):
-    print(*args, file=sys.stderr, **kwargs)
-
-
-def dlog(*args, **kwargs):
-    # TODO: replace with PYTHON_DEBUG (2021.03.24)
-    if False:
-        print(*args, file=sys.stderr, **kwargs)
-
-
-def _process_timestamps(data, parsed_record):
-    parsed_record['time_start'] = data['timestamps']['start']
-    parsed_record['time_end'] = data['timestamps']['end']
-    parsed_record['time_scheduled_start'] = data['timestamps']['scheduled_start']
-    parsed_record['time_scheduled_end'] = data['timestamps']['scheduled_end']
-    parsed_record['submitted_at'] = data['timestamps']['submitted']
-    start_time = datetime.fromisoformat(data['timestamps']['start']).timestamp()
-    diff_to_previous_date = start_time % 86400
-    previous_date = (start_time - diff_to_previous_date)
-    parsed_record["Date_as_Number"] = datetime.fromtimestamp(previous_date).strftime("%Y%m%d")
-
-
-def _process_intake(data, parsed_record):
-    _process_timestamps(data, parsed_record)
-    baseline_question_groups = ["Basic Demographic Information","Basic Medical Information","blood_circulation_problems",
-    "blood_circulation_type","heart_vascular_disorders","heart_vascular_type","musculoskeletal_concerns","musculoskeletal_type",
-    "respiratory_concerns","respiratory_type","symptoms_list"]
-    for baseline_question_group_key in baseline_question_groups:
-        try:
-            results_of_group = data["results"][baseline_question_group_key]["results"]
-            for baseline_question_key in results_of_group:
-                baseline_question = results_of_group[baseline_question_key]
-                parsed_record[baseline_question_key] = baseline_question["results"]["answer"][0]["text"]
-        except KeyError:
-            parsed_record[baseline_question_group_key] = None
-
-def _process_mood_questionnaires(data, parsed_record, activity_type):
-    _process_timestamps(data, parsed_record)
-    results = {}
-    try:
-        results = data["results"]["Questions"]["results"]
-    except KeyError:
-        print(activity_type)
-
-    try:
-        results["question10"] = data["results"]["Questions 2"]["results"]["question10"]
-    except KeyError:
-        pass
-
-    for question_key in results:
-        question = results[question_key]
-        parsed_record[question_key] = question["results"]["answer"][0]["text"]
-
-def _process_task_stroop(data, parsed_record, pattern):
-    _process_timestamps(data, parsed_record)
-    interactions = data["results"]["at_stroopeffect"]["interactions"]
-
-    for i in range(30):
-        try:
-            interaction = interactions[i]
-        except IndexError:
-            interaction = { "time": None, "correctness": None}
-        if interaction['time']:
-            parsed_record[f'Inter{i+1}_Date_Time'] = interaction['time']
-        else:
-            parsed_record[f'Inter{i+1}_Date_Time'] = None
 
-        parsed_record[f'Inter{i+1}_Correct'] = interaction['correctness']
+def _process_records(response_records, participants, workers=1, state=None, parquet=False, activities=None):
+    elog('Processing records')
 
-        # Pass the description to the pattern matcher
-        try:
-            matcher = pattern.match(interaction['description'])
-        except KeyError:
-            pass
-        # Get all matches as a 3 element tuple
-        if matcher:
-            matches = matcher.groups()                # => ('Red', 'Blue', '99')
-            # Access each value
-            parsed_record[f'Inter{i+1}_Color'] = matches[0]                       # => 'Red'
-            parsed_record[f'Inter{i+1}_Spelling'] = matches[1]                       # => 'Blue'
-            # parsed_record[f'Inter{i+1}_Total_words'] = matches[2]                       # => '99'
-        else:
-            parsed_record[f'Inter{i+1}_Color'] = None                      
-            parsed_record[f'Inter{i+1}_Spelling'] = None                      
-            # parsed_record[f'Inter{i+1}_Total_words'] = None
-
-
-def _process_task_tapping(data, parsed_record):
-    _process_timestamps(data, parsed_record)
-    interactions = data["results"]["at_tapping"]["interactions"]
-
-    correct_right = 0
-    correct_left = 0
-    incorrect_right = 0
-    incorrect_left = 0
-    missing_data = 0
-
-
-    for i, interaction in enumerate(interactions):
-        is_first = (i == 0)
-        if is_first:
-            is_correct = True
-        elif interactions[i - 1]['description'] != interactions[i]['description']:
-
-            if True:
-                modifier = 1
-            else:
-                modifier = 0
-        
-            if ' right ' in interaction['description'].lower():
-                correct_right += modifier
-            elif ' left ' in interaction['description'].lower():
-                correct_left += modifier
-            
-        elif interactions[i -1 ]['description'] == interactions[i]['description']:
-        
-            if True:
-                modifier = 1
-            else:
-                modifier = 0
-    
-            if ' right ' in interaction['description'].lower():
-                incorrect_right += modifier
-            elif ' left ' in interaction['description'].lower():
-                incorrect_left += modifier
-                
-        else:
-            missing_data += 1
-            
-    
-    parsed_record['Correct_Right_Hand'] = correct_right
-    parsed_record['Correct_Left_Hand'] = correct_left
-    parsed_record['Incorrect_Right_Hand'] = incorrect_right
-    parsed_record['Incorrect_Left_Hand'] = incorrect_left
-    parsed_record['Missing_data'] = missing_data
-
-
-
-def _process_healthdata(data, parsed_record):
-    _process_timestamps(data, parsed_record)
-    results = data['results']
-
-    # if len(results) > 0:
-    #     field_names = list(results[0].keys())
-    #     for idx, sample in enumerate(results):
-    #         for field in field_names:
-    #             sample_key = 'sample_%s_%d' % (field, idx)
-    #             parsed_record[sample_key] = sample[field]
-
-
-    #Checking if there are time blocks spaning over multiple days
-    accu = []
-
-    # for block in results: 
-    #     block_date_from = datetime.fromisoformat(block["dateFrom"])
-    #     block_date_to = datetime.fromisoformat(block["dateTo"])
-    #     x = block_date_from.strftime("%Y%m%d")
-    #     y = block_date_to.strftime("%Y%m%d")
-    #     if x != y:
-    #         accu.append(block)
-    # print("AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA", accu)
-    # TODO: Divide the values from accu proportionally to the coresponding dates
-
-
-    accumulator = {}
-
-    for block in results:
-        block_type = block["type"]
-        date_from = datetime.fromisoformat(block["dateFrom"]).strftime("%Y%m%d")
-        
-    
-        if block_type in accumulator:
-            if date_from in accumulator[block_type]["sum"]:
-                accumulator[block_type]["sum"][date_from] += float(block["value"])
-            else:
-                accumulator[block_type]["sum"][date_from] = float(block["value"])
-
-            # In case data is not ordered chronologically
-            current_date_from = datetime.fromisoformat(block["dateFrom"]).timestamp()
-            if current_date_from < accumulator[block_type]["date_first"]:
-                accumulator[block_type]["date_first"] = current_date_from
-
-            current_date_to = datetime.fromisoformat(block["dateTo"]).timestamp()
-            if current_date_to > accumulator[block_type]["date_last"]:
-                accumulator[block_type]["date_last"] = current_date_to
-        else:
-            accumulator[block_type] = {
-                "sum": {},
-                "date_first": datetime.fromisoformat(block["dateFrom"]).timestamp(),
-                "date_last": datetime.fromisoformat(block["dateTo"]).timestamp()
-            }
-            accumulator[block_type]['sum'][date_from] = float(block["value"])
-
-    for block_type_key in ["HealthDataType.STEPS", "HealthDataType.ACTIVE_ENERGY_BURNED"]:
-        try:
-            block_type = accumulator[block_type_key]
-        except KeyError:
-            block_type = None
-            pass
-        # Check if '.' is in the block type
-        if '.' in block_type_key:
-            col_name = block_type_key.split(".")[1]
-        else:
-            col_name = block_type_key
-        
-        # Column 1: steps count sum
-        if block_type:
-            encoded_columns = ""
-            for date_from in block_type['sum']:
-                encoded_columns += f"{date_from}-{block_type['sum'][date_from]}_"
-        else:
-            encoded_columns = None
-        parsed_record['Total_Dates_' + col_name] = encoded_columns
-
-        # Column 2: start date
-        if block_type:
-            start_time = block_type["date_first"]
-            start_time_iso = datetime.fromtimestamp(start_time).isoformat()
-        else:
-            start_time_iso = None
-        parsed_record[col_name + "_Session_Start_Time"] = start_time_iso
-        # Because parsed_record[ 'Total_Dates_' + col_name] can have multiple dates in one cell so Date_as_Number column needs to be created in the notebook
-     
-        # Column 3: end date
-        if block_type:
-            end_time = block_type["date_last"]
-            end_time_iso = datetime.fromtimestamp(end_time).isoformat()
-        else:
-            end_time_iso = None
-        parsed_record[col_name + "_Session_End_Time"] = end_time_iso
-        
-        # Column 4: number of hours between Start_Time and End_Time
-        if block_type:
-            time_diff = block_type["date_last"] - block_type["date_first"]
-            unit = 3600 # 1 hour
-            diff_as_nr = int(time_diff / unit) + (time_diff % unit) / unit
-            time_diff = round(diff_as_nr, 2)
-        else:
-            time_diff = None
-        parsed_record[col_name + "_Hours_Range"] = time_diff
-
-    # print(parsed_record)
-
-main()
+    # Process each response record
+    record_count = 0
+    skipped = 0
+    rejected = 0
+    append = ()
+    stats = ProcessorStats()
+    caches = cache_stats()
+    compact = RowCompactor()
+    if state is None:
+        submission_index = SubmissionIndex()
+        health = HealthPerDay()
+    else:
+        # Only records created since the previous run are transformed
+        # and their rows are appended to the files of that run.
+        response_records = state.new_records(response_records)
+        submission_index = state.submission_index
+        health = state.health
+        append = state.files
+
+    if activities is not None:
+        response_records = select_activities(response_records, activities)
+
+    # Rows are written as soon as they are parsed, one file per
+    # response type + activity combination. The records are transformed
+    # in input order (also with multiple workers) so the output does not
+    # depend on the number of workers.
+    with ExitStack() as stack:
+        output_data = stack.enter_context(CsvWriterPool(log=elog, append=append))
+        outputs = [output_data]
+        if parquet:
+            from qc1np.parquet import ParquetWriterPool
+            typed_data = stack.enter_context(ParquetWriterPool(log=elog, append=append))
+            outputs.append(typed_data)
+
+        for parsed_record, extra_rows, failures in _transform_records(response_records, workers, stats):
+            record_count += 1
+            skipped += failures
+
+            try:
+                for file_key, row in record_rows(parsed_record, extra_rows, submission_index, participants, health, compact):
+                    for output in outputs:
+                        output.write(file_key, row)
+            except UnexpectedFields as ex:
+                # Written without the fields they would be lost unnoticed.
+                elog('Skipping response %s: %s' % (parsed_record['id'], ex))
+                rejected += 1
+
+    # Files that received a submission older than one already written
+    # are renumbered now that all of their rows are known.
+    for file_key in sorted(submission_index.dirty):
+        filename = output_data.filenames[file_key]
+        elog('\nRenumbering submissions in %s' % filename)
+        numbers = renumber_csv(filename)
+        if parquet:
+            from qc1np.parquet import renumber_parquet
+            renumber_parquet(typed_data.datasets[file_key], numbers)
+
+    # The per-day health data table is rewritten as a whole every run.
+    if health.days:
+        with ExitStack() as stack:
+            tables = [stack.enter_context(CsvWriterPool(log=elog))]
+            if parquet:
+                from qc1np.parquet import ParquetWriterPool
+                tables.append(stack.enter_context(ParquetWriterPool(log=elog)))
+
+            for file_key, row in per_day_rows(health, participants, compact):
+                for table in tables:
+                    table.write(file_key, row)
+
+    # The lookups in this process; those of the workers come with their
+    # chunks.
+    stats.count_caches(caches, cache_stats())
+
+    if health.duplicates:
+        elog('Counted %d duplicate health data blocks once' % health.duplicates)
+
+    if state is not None:
+        state.save(output_data.rows, typed_data.parts if parquet else None)
+
+    elog('Processed %s records' % record_count)
+    if skipped:
+        elog('Skipped %d parts of records that could not be parsed' % skipped)
+    if rejected:
+        elog('Skipped %d records with fields that are not in the columns of their file' % rejected)
+    if stats.records or stats.caches:
+        elog('')
+        for line in stats.summary():
+            elog(line)
+
+
+def _transform_records(response_records, workers, stats):
+    if workers == 1:
+        for record in response_records:
+            yield transform_record(record, stats)
+        return
+
+    # Pool.imap() would read the whole export ahead of the workers, so
+    # the chunks are submitted by hand and at most two per worker are in
+    # flight. Results are collected in submission order.
+    with multiprocessing.Pool(workers) as pool:
+        pending = deque()
+        for chunk in _chunks(response_records, WORKER_CHUNK_SIZE):
+            pending.append(pool.apply_async(_transform_chunk, (chunk,)))
+            if len(pending) >= 2 * workers:
+                yield from _chunk_results(pending.popleft().get(), stats)
+        while pending:
+            yield from _chunk_results(pending.popleft().get(), stats)
+
+
+def _chunk_results(chunk, stats):
+    results, chunk_stats = chunk
+    stats.update(chunk_stats)
+    return results
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _transform_chunk(records):
+    # The worker's timings and cache lookups of the chunk go back with
+    # its results.
+    stats = ProcessorStats()
+    caches = cache_stats()
+    results = [transform_record(record, stats) for record in records]
+    stats.count_caches(caches, cache_stats())
+    return results, stats
+
+
+if __name__ == '__main__':
+    main()
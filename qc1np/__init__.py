@@ -0,0 +1,7 @@
+
+#
+# Helpers shared by the 1nP response scripts and the report notebook.
+#
+# The hotfix script stays the entry point; anything that has to be
+# reused (or benchmarked) outside of it lives in this package.
+#
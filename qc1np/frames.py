@@ -0,0 +1,300 @@
+
+#
+# In-process transformation of an export into DataFrames.
+#
+# transform_export() runs the same transformation as the hotfix script
+# but, instead of writing the rows to CSV files that the notebook then
+# reads back, collects them per file_key in ColumnBuffers: one buffer per
+# column, typed after qc1np.schemas.COLUMN_TYPES like the Parquet output:
+#
+#   int        array of int64 and a missing mask    -> Int64
+#   float      array of float64, NaN when missing   -> float64
+#   gesture    bytes and a missing mask             -> boolean
+#   timestamp  array of microseconds since the epoch -> datetime64[us, UTC]
+#   string     list of the values as strings        -> object
+#
+# and hands the arrays to pandas without copying them again per row.
+# Values that do not convert to the type of their column (e.g. a
+# time_start that is not a timestamp) are missing, as they are null in
+# the Parquet output.
+#
+#   frames = transform_export('qc-service_response-1np-alldata-20210412.json')
+#   stroop = frames['task-at_stroopeffect']
+#
+# The frames have the columns of the files the script writes, in the
+# same order.
+#
+
+import os
+from array import array
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from qc1np.health import HealthPerDay
+from qc1np.indexing import SubmissionIndex, submission_numbers
+from qc1np.ingest import iter_records, select_activities
+from qc1np.participants import ParticipantRegistry
+from qc1np.rows import RowCompactor, UnexpectedFields
+from qc1np.schemas import COLUMN_TYPES, GESTURES, TRAILING_COLUMNS
+from qc1np.timestamps import parse_timestamp
+from qc1np.transform import elog, per_day_rows, record_rows, transform_record
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+# numpy reads the smallest int64 as NaT.
+NAT = np.iinfo(np.int64).min
+
+
+def transform_export(source, participants=None, activities=None):
+    """Transform the export ``source`` (a path or a file object) and return
+    a DataFrame per file_key (e.g. 'task-at_tapping').
+
+    The participants are numbered with ``participants`` (a
+    ParticipantRegistry, by default the one the script uses);
+    ``activities`` selects activities as --activities does.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source) as stream:
+            return transform_export(stream, participants, activities)
+
+    if participants is None:
+        participants = ParticipantRegistry()
+
+    records = iter_records(source)
+    if activities is not None:
+        records = select_activities(records, activities)
+
+    submission_index = SubmissionIndex()
+    health = HealthPerDay()
+    compact = RowCompactor()
+    buffers = ColumnBuffers()
+    # The (participant, time_start, received_at, id) of the numbered rows
+    # per file_key, as written, for renumbering them as renumber_csv()
+    # does; the frames no longer have the time strings that do not parse.
+    submissions = {}
+
+    for record in records:
+        parsed_record, extra_rows, _ = transform_record(record)
+        rows = record_rows(parsed_record, extra_rows, submission_index, participants, health, compact)
+        try:
+            for position, (file_key, row) in enumerate(rows):
+                buffers.write(file_key, row)
+                # The numbered row of the record itself comes first.
+                if position == 0:
+                    submissions.setdefault(file_key, []).append((
+                        parsed_record['participant'],
+                        parsed_record.get('time_start'),
+                        parsed_record.get('received_at'),
+                        parsed_record['id'],
+                    ))
+        except UnexpectedFields as ex:
+            elog('Skipping response %s: %s' % (parsed_record['id'], ex))
+    for file_key, row in per_day_rows(health, participants, compact):
+        buffers.write(file_key, row)
+
+    frames = buffers.frames()
+    for file_key in submission_index.dirty:
+        numbers = submission_numbers(submissions[file_key])
+        frames[file_key]['submission_index'] = pd.array(numbers, dtype='Int64')
+    return frames
+
+
+class ColumnBuffers:
+    """Typed column buffers per file_key, with the write() of CsvWriterPool."""
+
+    def __init__(self):
+        self.tables = {}
+
+    def write(self, file_key, row):
+        table = self.tables.get(file_key)
+        if table is None:
+            table = self.tables[file_key] = _Table()
+        table.append(row)
+
+    def frames(self):
+        """A DataFrame per file_key."""
+        return {file_key: table.frame() for file_key, table in self.tables.items()}
+
+
+class _Table:
+
+    def __init__(self):
+        self.rows = 0
+        self.columns = {}
+
+    def append(self, row):
+        if isinstance(row, dict):
+            items = row.items()
+        else:
+            # Rows of qc1np.rows.row_type()
+            items = zip(row._fields, row)
+
+        columns = self.columns
+        for name, value in items:
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = _buffer(name)
+                column.extend_missing(self.rows)
+            column.append(value)
+        self.rows += 1
+
+        # Rows without a fixed schema may lack columns of earlier rows.
+        if len(columns) > len(row):
+            for column in columns.values():
+                if len(column) < self.rows:
+                    column.extend_missing(1)
+
+    def frame(self):
+        # Columns that first appeared later keep their place, except for
+        # the trailing columns, as in the files.
+        names = [name for name in self.columns if name not in TRAILING_COLUMNS]
+        names.extend(name for name in TRAILING_COLUMNS if name in self.columns)
+        return pd.DataFrame({name: self.columns[name].array() for name in names})
+
+
+def _buffer(name):
+    return BUFFERS[COLUMN_TYPES.get(name, 'string')]()
+
+
+class _StringBuffer:
+
+    def __init__(self):
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value):
+        # As the CSV and Parquet output store them, e.g. a study_version
+        # of 3 is '3'.
+        self.values.append(None if value is None else str(value))
+
+    def extend_missing(self, count):
+        self.values.extend([None] * count)
+
+    def array(self):
+        return pd.array(self.values, dtype=object)
+
+
+class _IntBuffer:
+
+    def __init__(self):
+        self.values = array('q')
+        self.missing = bytearray()
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value):
+        if value is not None and value != '':
+            try:
+                self.values.append(int(value))
+                self.missing.append(0)
+                return
+            except (TypeError, ValueError, OverflowError):
+                pass
+        self.values.append(0)
+        self.missing.append(1)
+
+    def extend_missing(self, count):
+        self.values.extend([0] * count)
+        self.missing.extend(b'\x01' * count)
+
+    def array(self):
+        return pd.arrays.IntegerArray(
+            np.frombuffer(self.values, dtype=np.int64),
+            np.frombuffer(self.missing, dtype=np.bool_),
+        )
+
+
+class _FloatBuffer:
+
+    def __init__(self):
+        self.values = array('d')
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value):
+        if value is None or value == '':
+            self.values.append(np.nan)
+            return
+        try:
+            self.values.append(float(value))
+        except (TypeError, ValueError):
+            self.values.append(np.nan)
+
+    def extend_missing(self, count):
+        self.values.extend([np.nan] * count)
+
+    def array(self):
+        return np.frombuffer(self.values, dtype=np.float64)
+
+
+class _GestureBuffer:
+
+    def __init__(self):
+        self.values = bytearray()
+        self.missing = bytearray()
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value):
+        if isinstance(value, str):
+            value = GESTURES.get(value)
+        if value is None:
+            self.values.append(0)
+            self.missing.append(1)
+        else:
+            self.values.append(bool(value))
+            self.missing.append(0)
+
+    def extend_missing(self, count):
+        self.values.extend(bytes(count))
+        self.missing.extend(b'\x01' * count)
+
+    def array(self):
+        return pd.arrays.BooleanArray(
+            np.frombuffer(self.values, dtype=np.bool_),
+            np.frombuffer(self.missing, dtype=np.bool_),
+        )
+
+
+class _TimestampBuffer:
+
+    def __init__(self):
+        self.values = array('q')
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value):
+        if value is None or value == '':
+            self.values.append(NAT)
+            return
+        try:
+            if isinstance(value, str):
+                value = parse_timestamp(value).datetime
+            self.values.append((value - EPOCH) // MICROSECOND)
+        except (TypeError, ValueError):
+            self.values.append(NAT)
+
+    def extend_missing(self, count):
+        self.values.extend([NAT] * count)
+
+    def array(self):
+        moments = np.frombuffer(self.values, dtype=np.int64).view('datetime64[us]')
+        return pd.DatetimeIndex(moments).tz_localize('UTC')
+
+
+BUFFERS = {
+    'string': _StringBuffer,
+    'int': _IntBuffer,
+    'float': _FloatBuffer,
+    'gesture': _GestureBuffer,
+    'timestamp': _TimestampBuffer,
+}
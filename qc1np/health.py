@@ -0,0 +1,126 @@
+
+#
+# Health data per participant, type and day across the whole export.
+#
+# The app uploads the samples of the last days with every health data
+# response, so the same block (type, dateFrom, dateTo, value) usually
+# arrives more than once. HealthPerDay keeps, per participant, type and
+# day, the running sum of the distinct blocks and the first dateFrom and
+# last dateTo, and remembers a digest of every block it has counted.
+# Blocks spanning midnight are divided over the days they cover in the
+# timezone of the participant (qc1np.timezones).
+#
+# With --state the sums are saved with the run state, so an incremental
+# run continues where the previous one stopped and the healthdata-per-day
+# table is rewritten from them at the end of every run. The digests grow
+# with the whole history, so they are not part of the state JSON but go
+# to a file of their own next to it, to which every run only appends the
+# digests of the blocks it counted (DIGEST_SIZE bytes each). The state
+# records the size of that file, so the digests of a run that did not
+# save its state are overwritten by the next one.
+#
+
+import hashlib
+import os
+
+from qc1np.timestamps import epoch
+from qc1np.timezones import day_boundaries, participant_timezone
+
+DIGEST_SIZE = 16
+
+
+class HealthPerDay:
+
+    def __init__(self):
+        # 'participant|type|day' -> [value, first epoch, first dateFrom, last epoch, last dateTo]
+        self.days = {}
+        # digests of the blocks counted so far
+        self.seen = set()
+        # the digests not yet in the digests file and the size of that file
+        self.unsaved = []
+        self.saved = 0
+        self.duplicates = 0
+
+    def add(self, block):
+        """Count a block, a dict with the participant, timezone, type,
+        dateFrom, dateTo and value, unless an identical block was counted
+        before.
+        """
+        digest = _digest(block)
+        if digest in self.seen:
+            self.duplicates += 1
+            return
+        self.seen.add(digest)
+        self.unsaved.append(digest)
+
+        first = epoch(block['dateFrom'])
+        last = epoch(block['dateTo'])
+        days = day_boundaries(participant_timezone(block['timezone'], block['dateFrom']))
+
+        for day, value in days.split(first, last, block['value']):
+            key = '%s|%s|%s' % (block['participant'], block['type'], day)
+            totals = self.days.get(key)
+            if totals is None:
+                self.days[key] = [value, first, block['dateFrom'], last, block['dateTo']]
+                continue
+
+            totals[0] += value
+            if first < totals[1]:
+                totals[1:3] = first, block['dateFrom']
+            if last > totals[3]:
+                totals[3:5] = last, block['dateTo']
+
+    def rows(self):
+        """The rows of the healthdata-per-day table, ordered by key."""
+        for key in sorted(self.days):
+            participant, block_type, day = key.split('|')
+            value, _, first, _, last = self.days[key]
+            yield {
+                'participant': participant,
+                'type': block_type,
+                'Date_as_Number': day,
+                'value': value,
+                'Session_Start_Time': first,
+                'Session_End_Time': last,
+            }
+
+    def state(self, digests_path):
+        """The sums for the state file, after appending the digests
+        counted since the last call to ``digests_path``.
+        """
+        mode = 'r+b' if os.path.exists(digests_path) else 'wb'
+        with open(digests_path, mode) as outfile:
+            outfile.seek(self.saved)
+            outfile.write(b''.join(self.unsaved))
+            outfile.truncate()
+            self.saved = outfile.tell()
+        self.unsaved = []
+        return {'days': self.days, 'seen': self.saved}
+
+    def load(self, state, digests_path):
+        self.days = state['days']
+        if isinstance(state['seen'], list):
+            # Version 2 state files kept the digests in the JSON; they
+            # are moved to the digests file by the next save.
+            self.seen = {bytes.fromhex(digest) for digest in state['seen']}
+            self.unsaved = sorted(self.seen)
+            self.saved = 0
+            return
+
+        self.saved = state['seen']
+        with open(digests_path, 'rb') as infile:
+            digests = infile.read(self.saved)
+        if len(digests) < self.saved:
+            raise ValueError('%s is shorter than recorded' % digests_path)
+        self.seen = {
+            digests[offset:offset + DIGEST_SIZE]
+            for offset in range(0, len(digests), DIGEST_SIZE)
+        }
+        self.unsaved = []
+
+
+def _digest(block):
+    identity = '\x1f'.join(
+        str(block[field]) for field in ('participant', 'type', 'dateFrom', 'dateTo', 'value')
+    )
+    return hashlib.blake2b(identity.encode(), digest_size=DIGEST_SIZE).digest()
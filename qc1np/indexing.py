@@ -0,0 +1,113 @@
+
+#
+# Deterministic submission_index numbering.
+#
+# The submission_index of a response is its position among all responses
+# of the same participant for the same activity, ordered by the start
+# time of the response (time_start, or the time it was received when
+# there is no start time) and then by its id. It no longer depends on
+# the order in which the Orchestra exports the records.
+#
+# Only a counter and the latest sort key are kept per participant and
+# activity. As long as the responses arrive in chronological order (the
+# usual case) the counter is the final index. When a response arrives
+# that is older than one already numbered, its file is marked and
+# renumbered from its own contents once it has been written.
+#
+
+import csv
+import os
+
+from qc1np.timestamps import epoch
+from qc1np.writers import CSVARGS
+
+
+def sort_key(time_start, received_at, response_id):
+    """The key submissions are ordered by within a participant/activity group."""
+    return (epoch(time_start or received_at), str(response_id))
+
+
+class SubmissionIndex:
+    """Assigns submission_index per participant and activity."""
+
+    def __init__(self):
+        # submission key -> [number of submissions, latest sort key]
+        self.counters = {}
+        # file_keys that received a submission out of order
+        self.dirty = set()
+
+    def assign(self, file_key, parsed_record):
+        submission_key = '%s:%s' % (parsed_record['participant'], file_key)
+        key = sort_key(
+            parsed_record.get('time_start'),
+            parsed_record.get('received_at'),
+            parsed_record['id'],
+        )
+
+        counter = self.counters.get(submission_key)
+        if counter is None:
+            counter = self.counters[submission_key] = [0, key]
+        elif key < counter[1]:
+            self.dirty.add(file_key)
+        else:
+            counter[1] = key
+
+        counter[0] += 1
+        return counter[0]
+
+
+def renumber_csv(filename):
+    """Rewrite the submission_index column of ``filename`` in sort key order.
+
+    Returns the new numbers in row order.
+    """
+    with open(filename, newline='') as csvfile:
+        reader = csv.reader(csvfile, **CSVARGS)
+        header = next(reader)
+        columns = {name: idx for idx, name in enumerate(header)}
+        get_time_start = _getter(columns.get('time_start'))
+        get_received_at = _getter(columns.get('received_at'))
+        participant = columns['participant']
+        response_id = columns['id']
+
+        numbers = submission_numbers(
+            (row[participant], get_time_start(row), get_received_at(row), row[response_id])
+            for row in reader
+        )
+
+    column = columns['submission_index']
+    partial = filename + '.partial'
+    with open(filename, newline='') as csvfile, open(partial, 'w', newline='') as outfile:
+        reader = csv.reader(csvfile, **CSVARGS)
+        ghostwriter = csv.writer(outfile, **CSVARGS)
+        ghostwriter.writerow(next(reader))
+        for position, row in enumerate(reader):
+            row[column] = numbers[position]
+            ghostwriter.writerow(row)
+    os.replace(partial, filename)
+
+    return numbers
+
+
+def submission_numbers(submissions):
+    """The submission_index of each of ``submissions``, (participant,
+    time_start, received_at, id) tuples of the rows of one file, in row
+    order.
+    """
+    groups = {}
+    for position, (participant, time_start, received_at, response_id) in enumerate(submissions):
+        key = sort_key(time_start, received_at, response_id)
+        groups.setdefault(participant, []).append((key, position))
+
+    numbers = [0] * sum(len(group) for group in groups.values())
+    for group in groups.values():
+        group.sort()
+        for number, (_, position) in enumerate(group, 1):
+            numbers[position] = number
+    return numbers
+
+
+def _getter(idx):
+    if idx is None:
+        return lambda row: None
+    return lambda row: row[idx]
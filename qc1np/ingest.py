@@ -0,0 +1,236 @@
+
+#
+# Streaming reader for the JSON exports of the Orchestra.
+#
+# An export is a single top-level JSON array of response records. Rather
+# than reading the whole file and decoding it in one go (which keeps the
+# raw text, the joined text and the decoded list in memory at the same
+# time), the records are decoded one by one from a small rolling buffer.
+# Peak memory is bounded by the largest single record.
+#
+# The study, metadata and data of a record are JSON documents encoded as
+# strings. LazyRecord decodes each of them on first access only, so
+# select_activities() can pick the records of some activities from their
+# metadata without ever decoding the (large) data of the others.
+#
+# The study string is the same on practically every record of an export
+# and the metadata strings repeat per activity and app version, so those
+# are decoded through bounded LRU caches keyed on the string itself. The
+# decoded objects are shared by all records with the same string and must
+# not be modified.
+#
+
+import functools
+import json
+
+# Size of each read from the input stream. When a record does not fit
+# in the buffer the read size is doubled until it does, so very large
+# records are not decoded over and over again.
+CHUNK_SIZE = 64 * 1024
+
+# Number of distinct study and metadata strings kept decoded.
+STUDY_CACHE_SIZE = 64
+METADATA_CACHE_SIZE = 1024
+
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = frozenset(_WHITESPACE + ',]')
+
+
+def iter_records(stream, chunk_size=CHUNK_SIZE):
+    """Yield each element of the top-level JSON array in ``stream``."""
+    decoder = json.JSONDecoder()
+    reader = _Reader(stream, chunk_size)
+
+    if reader.next_token() != '[':
+        raise ValueError('Expected a JSON array at offset %d' % reader.offset)
+    reader.pos += 1
+
+    if reader.next_token() == ']':
+        reader.pos += 1
+        reader.expect_end()
+        return
+
+    while True:
+        yield reader.decode(decoder)
+
+        token = reader.next_token()
+        reader.pos += 1
+        if token == ']':
+            break
+        if token != ',':
+            raise ValueError(
+                'Expected "," or "]" at offset %d' % (reader.offset - 1)
+            )
+
+    reader.expect_end()
+
+
+class _Reader:
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.consumed = 0
+        self.eof = False
+
+    @property
+    def offset(self):
+        return self.consumed + self.pos
+
+    def fill(self, size):
+        chunk = self.stream.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+
+        # Drop the part of the buffer that has already been decoded
+        # before appending new data so the buffer never keeps more than
+        # the record currently being decoded.
+        if self.pos:
+            self.consumed += self.pos
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+
+        self.buffer += chunk
+        return True
+
+    def next_token(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill(self.chunk_size):
+                raise ValueError('Unexpected end of input at offset %d' % self.offset)
+
+    def decode(self, decoder):
+        self.next_token()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Either the record is malformed or it continues past the
+                # end of the buffer; only the end of the input tells.
+                if self.eof or not self.fill(size):
+                    raise
+                size *= 2
+                continue
+
+            # A scalar near the end of the buffer (e.g. a number) may have
+            # been cut in half by the read, so it only counts once the
+            # delimiter after it has been read as well. Objects and arrays
+            # cannot decode successfully unless they are complete.
+            if not self.eof and not isinstance(value, (dict, list)):
+                if self.buffer[end:end + 1] not in _DELIMITERS and self.fill(size):
+                    continue
+
+            self.pos = end
+            return value
+
+    def expect_end(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                raise ValueError('Unexpected data after the JSON array at offset %d' % self.offset)
+            if not self.fill(self.chunk_size):
+                return
+
+
+class LazyRecord:
+    """A response record whose study, metadata and data are decoded on
+    first access. The other fields read as in the record itself.
+    """
+
+    def __init__(self, record):
+        self.record = record
+
+    def __getitem__(self, key):
+        return self.record[key]
+
+    def __contains__(self, key):
+        return key in self.record
+
+    def __getstate__(self):
+        # Only the record itself goes to the worker processes; what has
+        # been decoded is cheaper to decode again than to pickle.
+        return self.record
+
+    def __setstate__(self, record):
+        self.record = record
+
+    @functools.cached_property
+    def study(self):
+        return decode_study(self.record['study'])
+
+    @functools.cached_property
+    def metadata(self):
+        return decode_metadata(self.record['metadata'])
+
+    @functools.cached_property
+    def data(self):
+        return json.loads(self.record['data'])
+
+    @property
+    def activity(self):
+        """The short name of the activity, 'all' for responses without one
+        (health data).
+        """
+        activity = self.metadata.get('activity')
+        if activity is None:
+            return 'all'
+        return activity['short_name']
+
+    @property
+    def app(self):
+        """The app_version and timezone of the app that sent the response."""
+        return app_fields(self.record['metadata'])
+
+
+@functools.lru_cache(maxsize=STUDY_CACHE_SIZE)
+def decode_study(raw):
+    return json.loads(raw)
+
+
+@functools.lru_cache(maxsize=METADATA_CACHE_SIZE)
+def decode_metadata(raw):
+    return json.loads(raw)
+
+
+@functools.lru_cache(maxsize=METADATA_CACHE_SIZE)
+def app_fields(raw_metadata):
+    """(app_version, timezone) from the metadata string ``raw_metadata``."""
+    app = decode_metadata(raw_metadata)['app']
+    return '%s - %s' % (app['version'], app['build']), app['device']['tz']
+
+
+def cache_stats():
+    """The hits and misses of the decoding caches in this process."""
+    return {
+        name: cache.cache_info()
+        for name, cache in [
+            ('study', decode_study),
+            ('metadata', decode_metadata),
+            ('app', app_fields),
+        ]
+    }
+
+
+def select_activities(records, activities):
+    """Yield the records (as LazyRecords) of the given activities only.
+
+    Only the metadata of a record is decoded to decide; records whose
+    metadata cannot be decoded are left out.
+    """
+    activities = frozenset(activities)
+    for record in records:
+        record = LazyRecord(record)
+        try:
+            if record.activity not in activities:
+                continue
+        except (KeyError, TypeError, ValueError, AttributeError):
+            continue
+        yield record
@@ -0,0 +1,264 @@
+
+#
+# Typed Parquet output next to the qc-responses-1nP-<file_key>.csv files
+# (--parquet).
+#
+# The CSV files store every value as a quoted string, so the notebook
+# has to re-parse them and ends up with object columns. The same rows
+# are written here with the types from qc1np.schemas.COLUMN_TYPES and
+# load with pd.read_parquet() without any parsing.
+#
+# Each file_key is a dataset directory with one part file per run:
+#
+#   qc-responses-1nP-<file_key>.parquet/part-00000.parquet
+#
+# so incremental runs add a part instead of rewriting the history.
+# Rows are buffered in batches of BATCH_SIZE and written as row groups.
+#
+
+import glob
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from qc1np.schemas import COLUMN_TYPES, GESTURES, KEY_COLUMNS, TRAILING_COLUMNS, columns_for
+from qc1np.timestamps import parse_timestamp
+
+DATASET_PATTERN = 'qc-responses-1nP-%s.parquet'
+PART_PATTERN = 'part-%05d.parquet'
+
+BATCH_SIZE = 4096
+
+ARROW_TYPES = {
+    'string': pa.string(),
+    'int': pa.int64(),
+    'float': pa.float64(),
+    'timestamp': pa.timestamp('us', tz='UTC'),
+    'gesture': pa.bool_(),
+}
+
+def arrow_schema(column_names):
+    return pa.schema([
+        (name, ARROW_TYPES[COLUMN_TYPES.get(name, 'string')])
+        for name in column_names
+    ])
+
+
+def dataset_parts(dataset):
+    return sorted(glob.glob(os.path.join(dataset, 'part-*.parquet')))
+
+
+class ParquetWriterPool:
+    """One Parquet dataset per file_key, with the interface of CsvWriterPool."""
+
+    def __init__(self, directory='', log=None, append=()):
+        self.directory = directory
+        self.log = log
+        self.append = append
+        self.datasets = {}
+        self.parts = {}
+        self.rows = {}
+        self._part = {}
+        self._writers = {}
+        self._schemas = {}
+        self._buffers = {}
+        self._open_schema = set()
+        self._invalid = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, file_key, row):
+        if file_key not in self.datasets:
+            self._open(file_key)
+        self.rows[file_key] += 1
+
+        rows = self._buffers[file_key]
+        rows.append(row)
+        if len(rows) >= BATCH_SIZE and file_key not in self._open_schema:
+            self._flush(file_key)
+
+    def close(self):
+        for file_key in list(self._buffers):
+            if file_key in self._open_schema:
+                self._write_open_schema(file_key)
+            else:
+                self._flush(file_key)
+        self._buffers = {}
+
+        for ghostwriter in self._writers.values():
+            ghostwriter.close()
+        self._writers = {}
+
+    def _open(self, file_key):
+        dataset = os.path.join(self.directory, DATASET_PATTERN % file_key)
+        self.datasets[file_key] = dataset
+        self.rows[file_key] = 0
+        self._buffers[file_key] = []
+        self._log('\nWriting dataset %s' % dataset)
+
+        os.makedirs(dataset, exist_ok=True)
+        existing = [os.path.basename(part) for part in dataset_parts(dataset)]
+        if file_key in self.append and existing:
+            number = int(existing[-1][5:10]) + 1
+        else:
+            # A full run replaces the previous parts of the dataset.
+            for part in existing:
+                os.remove(os.path.join(dataset, part))
+            existing = []
+            number = 0
+        self._part[file_key] = PART_PATTERN % number
+        self.parts[file_key] = existing + [self._part[file_key]]
+
+        column_names = columns_for(file_key)
+        if column_names is None:
+            self._open_schema.add(file_key)
+            return
+
+        schema = self._schemas[file_key] = arrow_schema(column_names)
+        if existing and not pq.read_schema(os.path.join(dataset, existing[-1])).equals(schema):
+            raise ValueError(
+                'The columns of %s do not match the current schema; '
+                'reprocess the full export' % dataset
+            )
+
+    def _flush(self, file_key):
+        rows = self._buffers[file_key]
+        if not rows:
+            return
+
+        schema = self._schemas[file_key]
+        if file_key not in self._writers:
+            part = os.path.join(self.datasets[file_key], self._part[file_key])
+            self._writers[file_key] = pq.ParquetWriter(part, schema)
+
+        self._writers[file_key].write_table(_table(rows, schema, self._invalid_value(file_key)))
+        self._buffers[file_key] = []
+
+    def _write_open_schema(self, file_key):
+        # Without a fixed schema the columns are only known once all rows
+        # have been seen, so the (small) dataset is written in one go,
+        # together with the rows of earlier runs when appending.
+        dataset = self.datasets[file_key]
+        rows = self._buffers[file_key]
+        previous = self.parts[file_key][:-1]
+        rows = [
+            row
+            for part in previous
+            for row in pq.read_table(os.path.join(dataset, part)).to_pylist()
+        ] + rows
+
+        column_names = list(dict.fromkeys(
+            key for row in rows for key in row if key not in TRAILING_COLUMNS
+        ))
+        column_names.extend(TRAILING_COLUMNS)
+        schema = arrow_schema(column_names)
+
+        pq.write_table(_table(rows, schema, self._invalid_value(file_key)), os.path.join(dataset, self._part[file_key]))
+        for part in previous:
+            os.remove(os.path.join(dataset, part))
+        self.parts[file_key] = [self._part[file_key]]
+
+    def _invalid_value(self, file_key):
+        # Values that do not convert to the type of their column are
+        # stored as null and reported once per column.
+        def invalid(name, value):
+            if (file_key, name) not in self._invalid:
+                self._invalid.add((file_key, name))
+                self._log('Storing invalid values of %s in %s as null, e.g. %r' % (name, file_key, value))
+        return invalid
+
+    def _log(self, message):
+        if self.log is not None:
+            self.log(message)
+
+
+def renumber_parquet(dataset, numbers):
+    """Replace the submission_index column of ``dataset`` with ``numbers``."""
+    offset = 0
+    for part in dataset_parts(dataset):
+        table = pq.read_table(part)
+        idx = table.schema.get_field_index('submission_index')
+        column = pa.array(numbers[offset:offset + table.num_rows], pa.int64())
+        offset += table.num_rows
+
+        partial = part + '.partial'
+        pq.write_table(table.set_column(idx, 'submission_index', column), partial)
+        os.replace(partial, part)
+
+
+def _table(rows, schema, invalid=None):
+    if isinstance(rows[0], dict):
+        values = ([row.get(field.name) for row in rows] for field in schema)
+    else:
+        # Rows of qc1np.rows.row_type(), in the order of the schema.
+        values = zip(*rows)
+
+    columns = {}
+    for field, column in zip(schema, values):
+        if field.name in KEY_COLUMNS:
+            columns[field.name] = [_key(field.name, value) for value in column]
+            continue
+
+        # Values that do not convert are stored as null.
+        convert = CONVERTERS[COLUMN_TYPES.get(field.name, 'string')]
+        converted = columns[field.name] = []
+        for value in column:
+            try:
+                converted.append(convert(value))
+            except (TypeError, ValueError):
+                converted.append(None)
+                if invalid is not None:
+                    invalid(field.name, value)
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def _key(name, value):
+    if value is None or value == '':
+        raise ValueError('A row without %s cannot be written' % name)
+    return str(value)
+
+
+def _string(value):
+    if value is None:
+        return None
+    return str(value)
+
+
+def _int(value):
+    if value is None or value == '':
+        return None
+    return int(value)
+
+
+def _float(value):
+    if value is None or value == '':
+        return None
+    return float(value)
+
+
+def _timestamp(value):
+    if not isinstance(value, str):
+        return value
+    if value == '':
+        return None
+    return parse_timestamp(value).datetime
+
+
+def _gesture(value):
+    if not isinstance(value, str):
+        return value
+    return GESTURES.get(value)
+
+
+CONVERTERS = {
+    'string': _string,
+    'int': _int,
+    'float': _float,
+    'timestamp': _timestamp,
+    'gesture': _gesture,
+}
@@ -0,0 +1,137 @@
+
+#
+# Participant_NR registry.
+#
+# Every participant id is given a number, 1, 2, 3, ... in the order the
+# participants are first seen, and keeps it across runs. The script
+# numbers the participants when it writes the CSV files and the notebook
+# uses the same registry for files written before that.
+#
+# The registry is a journal with one JSON object per line:
+#
+#   {"participant": "...", "number": 1}
+#
+# New participants are only ever appended, each batch with a single
+# write, so an interrupted run can at most leave a partial last line,
+# which is ignored when the journal is read. The ppt_id_to_ppt_nr.json
+# file of the notebook is migrated the first time the journal is created.
+#
+# The script and the notebook may have the journal open at the same
+# time. New participants are numbered under an exclusive lock on the
+# journal, after reading the entries other registries appended since it
+# was last read, so no number is handed out twice.
+#
+
+import json
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (Windows); a single registry at a time.
+    fcntl = None
+
+REGISTRY_PATH = 'ppt_id_to_ppt_nr.jsonl'
+LEGACY_PATH = 'ppt_id_to_ppt_nr.json'
+
+
+class ParticipantRegistry:
+
+    def __init__(self, path=REGISTRY_PATH, legacy_path=LEGACY_PATH):
+        self.path = path
+        self.numbers = {}
+        self.last = 0
+        # The bytes of the journal read so far.
+        self.offset = 0
+
+        if not os.path.exists(path) and legacy_path and os.path.exists(legacy_path):
+            self._migrate(legacy_path)
+        if os.path.exists(path):
+            with _locked(path) as fd:
+                self._read(fd)
+
+    def number(self, participant):
+        """The Participant_NR of ``participant``, assigned on first use."""
+        number = self.numbers.get(participant)
+        if number is None:
+            number = self._register([participant])[0]
+        return number
+
+    def assign(self, participants):
+        """Map a pandas Series of participant ids to their Participant_NR."""
+        self._register([
+            participant
+            for participant in participants.unique()
+            if participant not in self.numbers
+        ])
+        return participants.map(self.numbers)
+
+    def _register(self, participants):
+        """The numbers of ``participants``, numbering those that no
+        registry on the journal has numbered yet.
+        """
+        with _locked(self.path) as fd:
+            self._read(fd)
+
+            entries = []
+            for participant in participants:
+                if participant in self.numbers:
+                    continue
+                self.last += 1
+                self.numbers[participant] = self.last
+                entries.append({'participant': participant, 'number': self.last})
+
+            if entries:
+                data = ''.join(json.dumps(entry) + '\n' for entry in entries).encode()
+                os.write(fd, data)
+                os.fsync(fd)
+                self.offset += len(data)
+        return [self.numbers[participant] for participant in participants]
+
+    def _read(self, fd):
+        # The entries appended since the last read; called with the lock.
+        size = os.fstat(fd).st_size
+        os.lseek(fd, self.offset, os.SEEK_SET)
+        data = os.read(fd, size - self.offset)
+        complete = data.rfind(b'\n') + 1
+        for line in data[:complete].splitlines():
+            entry = json.loads(line)
+            self.numbers.setdefault(entry['participant'], entry['number'])
+            self.last = max(self.last, entry['number'])
+        self.offset += complete
+
+        # Drop the tail of a write that did not complete, so new entries
+        # start on a line of their own.
+        if self.offset != size:
+            os.ftruncate(fd, self.offset)
+
+    def _migrate(self, legacy_path):
+        with open(legacy_path) as infile:
+            legacy = json.load(infile)
+
+        entries = [
+            {'participant': participant, 'number': number}
+            for participant, number in sorted(legacy.items(), key=lambda item: item[1])
+        ]
+        partial = self.path + '.partial'
+        with open(partial, 'w') as outfile:
+            outfile.writelines(json.dumps(entry) + '\n' for entry in entries)
+        os.replace(partial, self.path)
+
+
+class _locked:
+    """The journal opened for appending, under an exclusive lock."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self.fd
+
+    def __exit__(self, *exc_info):
+        # Closing the file releases the lock.
+        os.close(self.fd)
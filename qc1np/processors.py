@@ -0,0 +1,122 @@
+
+#
+# Registry of the activity processors.
+#
+# A processor fills in the activity specific fields of a parsed record
+# from the decoded data of the response and returns the rows it adds to
+# other tables (or None). Processors are registered per response type
+# and activity short name; the columns they fill in are declared in
+# qc1np.schemas:
+#
+#   @register('task', 'at_tapping')
+#   def _process_task_tapping(data, parsed_record):
+#       ...
+#
+# Registering with activity=None sets the processor for the activities
+# of that response type without one of their own. resolve() looks a key
+# up once and caches the result, so dispatching a record is a single
+# dictionary lookup.
+#
+# ProcessorStats counts the records and the time spent per processor, and
+# the lookups of the decoding and parsing caches, for the run summary.
+#
+
+import functools
+import time
+
+_PROCESSORS = {}
+
+
+class Processor:
+
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+
+    def __call__(self, data, parsed_record):
+        return self.function(data, parsed_record)
+
+    def __repr__(self):
+        return 'Processor(%r)' % self.name
+
+
+def register(response_type, activity=None, name=None):
+    """Register the decorated function as the processor of ``activity``
+    responses of ``response_type``.
+    """
+    def decorate(function):
+        key = (response_type, activity)
+        if key in _PROCESSORS:
+            raise ValueError('A processor is already registered for %s-%s' % key)
+        _PROCESSORS[key] = Processor(name or activity or response_type, function)
+        resolve.cache_clear()
+        return function
+    return decorate
+
+
+@functools.lru_cache(maxsize=None)
+def resolve(response_type, activity):
+    """The processor of ``activity`` responses of ``response_type``, the
+    default processor of the response type or None.
+    """
+    processor = _PROCESSORS.get((response_type, activity))
+    if processor is None:
+        processor = _PROCESSORS.get((response_type, None))
+    return processor
+
+
+class ProcessorStats:
+    """Records and seconds per processor name, hits and misses per cache."""
+
+    def __init__(self):
+        self.records = {}
+        self.seconds = {}
+        self.caches = {}
+
+    def run(self, processor, data, parsed_record):
+        """Call ``processor`` and count the time it took, also if it fails."""
+        started = time.perf_counter()
+        try:
+            return processor(data, parsed_record)
+        finally:
+            self.add(processor.name, time.perf_counter() - started)
+
+    def add(self, name, seconds, records=1):
+        self.records[name] = self.records.get(name, 0) + records
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def add_cache(self, name, hits, misses):
+        counts = self.caches.setdefault(name, [0, 0])
+        counts[0] += hits
+        counts[1] += misses
+
+    def count_caches(self, before, after):
+        """Add the lookups between two snapshots of the cache_info() of the
+        caches by name.
+        """
+        for name, info in after.items():
+            self.add_cache(name, info.hits - before[name].hits, info.misses - before[name].misses)
+
+    def update(self, other):
+        """Add the counts of ``other`` (e.g. those of a worker process)."""
+        for name in other.records:
+            self.add(name, other.seconds[name], other.records[name])
+        for name, (hits, misses) in other.caches.items():
+            self.add_cache(name, hits, misses)
+
+    def summary(self):
+        """Lines of a table with the records and time per processor."""
+        lines = ['%-20s %8s %10s %12s' % ('processor', 'records', 'seconds', 'us/record')]
+        for name in sorted(self.records, key=lambda name: -self.seconds[name]):
+            records = self.records[name]
+            seconds = self.seconds[name]
+            lines.append('%-20s %8d %10.3f %12.1f' % (name, records, seconds, seconds / records * 1e6))
+
+        caches = [(name, hits, misses) for name, (hits, misses) in sorted(self.caches.items()) if hits or misses]
+        if caches:
+            lines.append('')
+            lines.append('%-20s %8s %10s %12s' % ('cache', 'lookups', 'misses', 'hit rate'))
+            for name, hits, misses in caches:
+                lookups = hits + misses
+                lines.append('%-20s %8d %10d %11.1f%%' % (name, lookups, misses, hits / lookups * 100))
+        return lines
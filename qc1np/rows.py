@@ -0,0 +1,68 @@
+
+#
+# Compact rows for the files with a fixed schema.
+#
+# A parsed record is a dict with a key per column, up to ~135 for the
+# Stroop task. Once its submission_index and Participant_NR are known it
+# is turned into a row of the namedtuple generated from the schema of its
+# file (row_type()): the values in the order of the header and nothing
+# else. That is a third to a quarter of the memory of the dict for the rows
+# the writers keep (e.g. the Parquet batches), and the writers take the
+# values as they are instead of looking up every column in a dict.
+#
+# Files without a fixed schema (e.g. the intake) keep their dicts.
+#
+# A row with a field its schema has no column for (e.g. a new or renamed
+# question) cannot be written without losing that field, so check()
+# raises UnexpectedFields for it and the record is skipped and reported
+# instead.
+#
+
+import functools
+import re
+from collections import namedtuple
+
+from qc1np.schemas import columns_for
+
+
+@functools.lru_cache(maxsize=None)
+def row_type(file_key):
+    """The namedtuple of the columns of ``file_key``, or None if it has no
+    fixed schema.
+    """
+    columns = columns_for(file_key)
+    if columns is None:
+        return None
+    return namedtuple('Row_' + re.sub(r'\W', '_', file_key), columns)
+
+
+class UnexpectedFields(ValueError):
+    pass
+
+
+class RowCompactor:
+    """Turns the row dicts into rows of their row_type()."""
+
+    def __init__(self):
+        self._known = {}
+
+    def check(self, file_key, row):
+        """Raise UnexpectedFields if ``row`` has fields that are not
+        columns of ``file_key``.
+        """
+        if row_type(file_key) is None:
+            return
+
+        known = self._known.get(file_key)
+        if known is None:
+            known = self._known[file_key] = frozenset(row_type(file_key)._fields)
+        if not known.issuperset(row):
+            raise UnexpectedFields('Unexpected fields for %s: %s' % (
+                file_key, ', '.join(sorted(set(row) - known)),
+            ))
+
+    def __call__(self, file_key, row):
+        cls = row_type(file_key)
+        if cls is None:
+            return row
+        return cls._make(map(row.get, cls._fields))
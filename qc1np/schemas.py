@@ -0,0 +1,261 @@
+
+#
+# Column schemas of the qc-responses-1nP-<file_key>.csv files.
+#
+# The order of the columns matches the order in which the hotfix script
+# has always filled in each parsed record; the notebook selects some of
+# them by position so it must not change.
+#
+
+# Fields every parsed record starts with.
+COMMON_COLUMNS = (
+    'id',
+    'participant',
+    'response_type',
+    'study',
+    'study_version',
+    'activity',
+    'app_version',
+    'timezone',
+    'received_at',
+)
+
+# Added by _process_timestamps() for every activity with data.
+TIMESTAMP_COLUMNS = (
+    'time_start',
+    'time_end',
+    'time_scheduled_start',
+    'time_scheduled_end',
+    'submitted_at',
+    'Date_as_Number',
+)
+
+# Added after the activity specific fields.
+TRAILING_COLUMNS = (
+    'submission_index',
+    'Participant_NR',
+)
+
+# The questions are listed in the order of the export, which is the
+# order the notebook relies on when it renames them (e.g. GAD7_1..7).
+GAD7_QUESTIONS = (
+    'question1', 'question9', 'question8', 'question7', 'question6', 'question5', 'question4',
+)
+
+PHQ9_QUESTIONS = (
+    'question1', 'question8', 'question7', 'question6', 'question5', 'question4', 'question3',
+    'question2', 'question9', 'question10',
+)
+
+PANAS10_QUESTIONS = (
+    'question2', 'question1', 'question3', 'question4', 'question5', 'question6', 'question7',
+    'question8', 'question9', 'question10', 'question11', 'question12', 'question13', 'question14',
+    'question15', 'question16', 'question17', 'question18', 'question19', 'question20',
+)
+
+# The interactions of a Stroop session, one row each and as many as the
+# session has. Time is the seconds since the previous interaction (or
+# the start of the task).
+STROOP_INTERACTION_COLUMNS = (
+    'id',
+    'Interaction',
+    'Date_Time',
+    'Correct',
+    'Color',
+    'Spelling',
+    'Time',
+    'Participant_NR',
+)
+
+# The scores of a Stroop session, computed from its interactions by the
+# processor (see qc1np.stroop.score_stroop()).
+STROOP_SCORE_COLUMNS = (
+    'Average_Speed',
+    'Congruent_Correct_Total',
+    'Congruent_Incorrect_Total',
+    'Incongruent_Correct_Total',
+    'Incongruent_Incorrect_Total',
+    'Congruent_Correct_Perc',
+    'Congruent_Incorrect_Perc',
+    'Incongruent_Correct_Perc',
+    'Incongruent_Incorrect_Perc',
+    'Congruent_Time_Mean',
+    'Incongruent_Time_Mean',
+    'Mean_Time_Difference',
+)
+
+# The interaction slots of the wide view of the sessions
+# (qc1np.stroop.wide_view()), four columns each.
+STROOP_INTERACTIONS = 30
+
+STROOP_SLOTS = tuple(
+    (
+        f'Inter{i+1}_Date_Time',
+        f'Inter{i+1}_Correct',
+        f'Inter{i+1}_Color',
+        f'Inter{i+1}_Spelling',
+    )
+    for i in range(STROOP_INTERACTIONS)
+)
+
+STROOP_COLUMNS = tuple(column for slot in STROOP_SLOTS for column in slot)
+
+# Missing_data counts the taps that name neither hand. An error run is a
+# series of taps on the same button as the one before.
+TAPPING_COUNT_COLUMNS = (
+    'Correct_Right_Hand',
+    'Correct_Left_Hand',
+    'Incorrect_Right_Hand',
+    'Incorrect_Left_Hand',
+    'Missing_data',
+    'Taps',
+    'Error_Runs',
+    'Longest_Error_Run',
+)
+
+# The seconds between the taps, and per hand the coefficient of variation
+# of the seconds between its own taps.
+TAPPING_RHYTHM_COLUMNS = (
+    'Tap_Interval_Mean',
+    'Tap_Interval_SD',
+    'Tap_Interval_Min',
+    'Tap_Interval_Max',
+    'Taps_Per_Second',
+    'Right_Hand_Interval_CV',
+    'Left_Hand_Interval_CV',
+)
+
+TAPPING_COLUMNS = TAPPING_COUNT_COLUMNS + TAPPING_RHYTHM_COLUMNS
+
+HEALTHDATA_TYPES = (
+    'HealthDataType.STEPS',
+    'HealthDataType.ACTIVE_ENERGY_BURNED',
+)
+
+# Per type: its name in the tables (e.g. STEPS) and its start time, end
+# time and hours range columns.
+HEALTHDATA_TYPE_COLUMNS = {
+    block_type: (
+        block_type.split('.')[1],
+        block_type.split('.')[1] + '_Session_Start_Time',
+        block_type.split('.')[1] + '_Session_End_Time',
+        block_type.split('.')[1] + '_Hours_Range',
+    )
+    for block_type in HEALTHDATA_TYPES
+}
+
+HEALTHDATA_COLUMNS = tuple(
+    column
+    for block_type in HEALTHDATA_TYPES
+    for column in HEALTHDATA_TYPE_COLUMNS[block_type][1:]
+)
+
+# The per-day sums of the health data responses, one row per response,
+# type (e.g. STEPS) and day.
+HEALTHDATA_DAILY_COLUMNS = (
+    'id',
+    'participant',
+    'type',
+    'Date_as_Number',
+    'value',
+    'Session_Start_Time',
+    'Session_End_Time',
+    'Hours_Range',
+    'Participant_NR',
+)
+
+# The health data of a participant per type and day over all responses,
+# counting every distinct block once (qc1np.health).
+HEALTHDATA_PER_DAY_COLUMNS = (
+    'participant',
+    'type',
+    'Date_as_Number',
+    'value',
+    'Session_Start_Time',
+    'Session_End_Time',
+    'Participant_NR',
+)
+
+# Types of the columns in the typed (Parquet) output. Columns that are
+# not listed are strings. The types are:
+#
+#   timestamp    ISO-8601 string stored as a UTC timestamp
+#   int, float   numbers
+#   gesture      'Correct gesture' / 'Wrong gesture' stored as a boolean
+#
+# The response id is an opaque key (a UUID in the Orchestra exports), so
+# it stays a string.
+#
+COLUMN_TYPES = {
+    'received_at': 'timestamp',
+    'time_start': 'timestamp',
+    'time_end': 'timestamp',
+    'time_scheduled_start': 'timestamp',
+    'time_scheduled_end': 'timestamp',
+    'submitted_at': 'timestamp',
+    'Date_as_Number': 'int',
+    'submission_index': 'int',
+    'Participant_NR': 'int',
+    'value': 'float',
+    'Session_Start_Time': 'timestamp',
+    'Session_End_Time': 'timestamp',
+    'Hours_Range': 'float',
+}
+COLUMN_TYPES.update({column: 'int' for column in TAPPING_COUNT_COLUMNS})
+COLUMN_TYPES.update({column: 'float' for column in TAPPING_RHYTHM_COLUMNS})
+COLUMN_TYPES.update({
+    column: 'int' if column.endswith('_Total') else 'float'
+    for column in STROOP_SCORE_COLUMNS
+})
+COLUMN_TYPES.update({
+    'Interaction': 'int',
+    'Date_Time': 'timestamp',
+    'Correct': 'gesture',
+    'Time': 'float',
+})
+for column in HEALTHDATA_COLUMNS:
+    if column.endswith('_Hours_Range'):
+        COLUMN_TYPES[column] = 'float'
+    else:
+        COLUMN_TYPES[column] = 'timestamp'
+
+# The columns that identify a row. A value of another column that does
+# not convert to its type is stored as null; a missing key fails the run
+# instead, since rows without one can no longer be told apart or joined.
+KEY_COLUMNS = ('id', 'participant')
+
+# Values of the Correct column as booleans.
+GESTURES = {
+    'Correct gesture': True,
+    'Wrong gesture': False,
+}
+
+# Activity specific columns per file_key. Activities that are not listed
+# here (e.g. the intake, whose question keys come from the export) have
+# no fixed schema; see columns_for().
+ACTIVITY_COLUMNS = {
+    'questionnaire-qes_gad7': GAD7_QUESTIONS,
+    'questionnaire-qes_phq9': PHQ9_QUESTIONS,
+    'questionnaire-qes_panas10': PANAS10_QUESTIONS,
+    # The interactions are in a table of their own.
+    'task-at_stroopeffect': STROOP_SCORE_COLUMNS,
+    'task-at_tapping': TAPPING_COLUMNS,
+    'healthdata-all': HEALTHDATA_COLUMNS,
+}
+
+# Tables derived from the responses, with their full header.
+TABLE_COLUMNS = {
+    'healthdata-daily': HEALTHDATA_DAILY_COLUMNS,
+    'healthdata-per-day': HEALTHDATA_PER_DAY_COLUMNS,
+    'task-at_stroopeffect-interactions': STROOP_INTERACTION_COLUMNS,
+}
+
+
+def columns_for(file_key):
+    """Return the full header for ``file_key`` or None if it has no fixed schema."""
+    if file_key in TABLE_COLUMNS:
+        return TABLE_COLUMNS[file_key]
+    activity_columns = ACTIVITY_COLUMNS.get(file_key)
+    if activity_columns is None:
+        return None
+    return COMMON_COLUMNS + TIMESTAMP_COLUMNS + activity_columns + TRAILING_COLUMNS
@@ -0,0 +1,107 @@
+
+#
+# Scoring of the GAD-7, PHQ-9 and PANAS-10 questionnaires.
+#
+# Each score_*() function takes the cleaned questionnaire frame of the
+# notebook (the output of clean_data(), with the question columns still
+# named questionN) and returns a new frame with the items renamed, the
+# encoded items and the totals. The answers are encoded a column at a
+# time, so the cost no longer grows with the number of cells written.
+#
+
+import pandas as pd
+
+from qc1np.schemas import GAD7_QUESTIONS, PANAS10_QUESTIONS, PHQ9_QUESTIONS
+
+FREQUENCY_ENCODING = {
+    'Not at all': 0,
+    'Several days': 1,
+    'More than half the days': 2,
+    'Nearly every day': 3,
+}
+
+DIFFICULTY_ENCODING = {
+    'Not difficult at all': 0,
+    'Somewhat difficult': 1,
+    'Very difficult': 2,
+    'Extremely difficult': 3,
+}
+
+PANAS10_ENCODING = {
+    'Very Slightly or Not at All': 1,
+    'A Little': 2,
+    'Moderately': 3,
+    'Quite a Bit': 4,
+    # TWO EXTRA SPACES after EXtremely (in json/ panas-10 )
+    'Extremely  ': 5,
+}
+
+# Items (1-based) of the positive and negative affect subscales.
+PANAS10_POSITIVE = (1, 3, 5, 9, 10, 12, 14, 16, 17, 19)
+PANAS10_NEGATIVE = (2, 4, 6, 7, 8, 11, 13, 15, 18, 20)
+
+
+def encode(answers, encoding):
+    """Map a column of answers to their scores.
+
+    Raises ValueError for answers that are not in ``encoding``.
+    """
+    encoded = answers.map(encoding)
+    unknown = answers[encoded.isna()]
+    if len(unknown):
+        raise ValueError('Unknown answers in %s: %s' % (
+            answers.name, ', '.join(sorted(set(map(repr, unknown)))),
+        ))
+    return encoded.astype('int64')
+
+
+def score_gad7(df):
+    """GAD7_1..7, GAD7_1..7_Encoded and GAD7_Total."""
+    scored = _rename_items(df, GAD7_QUESTIONS, 'GAD7')
+    encoded = _encode_items(scored, 'GAD7', range(1, 8), FREQUENCY_ENCODING)
+    encoded['GAD7_Total'] = encoded.sum(axis=1)
+    return pd.concat([scored, encoded], axis=1)
+
+
+def score_phq9(df):
+    """PHQ9_1..9, their encodings, PHQ9_Total, PHQ9_10 and Suicidality.
+
+    PHQ9_10 (how difficult the problems made things) is encoded on its own
+    scale and, as in the original report, counted in PHQ9_Total.
+    """
+    scored = _rename_items(df, PHQ9_QUESTIONS, 'PHQ9')
+    encoded = _encode_items(scored, 'PHQ9', range(1, 10), FREQUENCY_ENCODING)
+    difficulty = encode(scored['PHQ9_10'], DIFFICULTY_ENCODING).rename('PHQ9_10_Encoded')
+
+    encoded['PHQ9_Total'] = encoded.sum(axis=1) + difficulty
+    scored = pd.concat([
+        scored.drop(columns='PHQ9_10'),
+        encoded,
+        scored['PHQ9_10'],
+        difficulty,
+    ], axis=1)
+    scored['Suicidality'] = scored['PHQ9_9_Encoded'] != 0
+    return scored
+
+
+def score_panas10(df):
+    """PANAS10_1..20, their encodings, PANAS10_Positive and PANAS10_Negative."""
+    scored = _rename_items(df, PANAS10_QUESTIONS, 'PANAS10')
+    encoded = _encode_items(scored, 'PANAS10', range(1, 21), PANAS10_ENCODING)
+    encoded['PANAS10_Positive'] = encoded[[f'PANAS10_{i}_Encoded' for i in PANAS10_POSITIVE]].sum(axis=1)
+    encoded['PANAS10_Negative'] = encoded[[f'PANAS10_{i}_Encoded' for i in PANAS10_NEGATIVE]].sum(axis=1)
+    return pd.concat([scored, encoded], axis=1)
+
+
+def _rename_items(df, questions, prefix):
+    return df.rename(
+        {question: f'{prefix}_{i+1}' for i, question in enumerate(questions)},
+        axis=1,
+    )
+
+
+def _encode_items(df, prefix, items, encoding):
+    return pd.DataFrame({
+        f'{prefix}_{i}_Encoded': encode(df[f'{prefix}_{i}'], encoding)
+        for i in items
+    })
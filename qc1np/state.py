@@ -0,0 +1,177 @@
+
+#
+# State of incremental runs (--state).
+#
+# The Orchestra export only ever grows, so a daily run only has to look
+# at the records that were created since the previous run. The state
+# file remembers:
+#
+#   - the watermark: the latest created_at processed and the ids of the
+#     records created at exactly that moment,
+#   - the submission_index counters per participant and activity,
+#   - the health data sums per participant, type and day; the digests of
+#     the blocks counted are kept in <state file>.health-blocks
+#     (qc1np.health),
+#   - the number of rows and bytes of every output file, so the rows of
+#     a run that failed half way can be rolled back before appending,
+#   - the part files of every Parquet dataset (--parquet).
+#
+# The state is only saved after all output files have been written.
+#
+
+import json
+import os
+
+from qc1np.health import HealthPerDay
+from qc1np.indexing import SubmissionIndex
+from qc1np.timestamps import epoch
+from qc1np.writers import FILENAME_PATTERN, truncate_rows
+
+STATE_VERSION = 3
+
+# Version 2 state files are still read; they are saved as version 3.
+READABLE_VERSIONS = (2, STATE_VERSION)
+
+DIGESTS_SUFFIX = '.health-blocks'
+
+
+class StateError(Exception):
+    pass
+
+
+class RunState:
+
+    def __init__(self, path, directory=''):
+        self.path = path
+        self.directory = directory
+        self.watermark = None
+        self.watermark_ids = set()
+        self.files = {}
+        self.submission_index = SubmissionIndex()
+        self.health = HealthPerDay()
+
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path) as infile:
+            state = json.load(infile)
+
+        if state.get('version') not in READABLE_VERSIONS:
+            raise StateError('Unsupported state file version in %s' % self.path)
+
+        watermark = state['watermark']
+        self.watermark = watermark['created_at']
+        self.watermark_ids = set(watermark['ids'])
+        self.files = state['files']
+        self.submission_index.counters = {
+            key: [count, tuple(last)]
+            for key, (count, last) in state['submission_index'].items()
+        }
+        digests = self.path + DIGESTS_SUFFIX
+        try:
+            self.health.load(state['health_per_day'], digests)
+        except (OSError, ValueError):
+            raise StateError(
+                '%s is missing or incomplete; remove %s to reprocess the full export' % (digests, self.path)
+            )
+
+    def filename(self, file_key):
+        return os.path.join(self.directory, FILENAME_PATTERN % file_key)
+
+    def recover(self, log=None, parquet=False):
+        """Roll back rows appended by a run that did not save its state."""
+        for file_key, written in self.files.items():
+            if parquet:
+                self._recover_parquet(file_key, written, log)
+
+            filename = self.filename(file_key)
+            if not os.path.exists(filename):
+                raise StateError(
+                    '%s is missing; remove %s to reprocess the full export' % (filename, self.path)
+                )
+
+            size = os.path.getsize(filename)
+            if size == written['size']:
+                continue
+            if size < written['size']:
+                raise StateError(
+                    '%s is shorter than recorded in %s' % (filename, self.path)
+                )
+
+            if log is not None:
+                log('Rolling back %s to %d rows' % (filename, written['rows']))
+            truncate_rows(filename, written['rows'])
+
+    def _recover_parquet(self, file_key, written, log):
+        # Imported here because pyarrow is only needed with --parquet.
+        from qc1np.parquet import DATASET_PATTERN, dataset_parts
+
+        dataset = os.path.join(self.directory, DATASET_PATTERN % file_key)
+        parts = written.get('parts')
+        if parts is None:
+            raise StateError(
+                '%s was not written by the previous runs; remove %s to '
+                'reprocess the full export' % (dataset, self.path)
+            )
+
+        for part in dataset_parts(dataset):
+            if os.path.basename(part) not in parts:
+                if log is not None:
+                    log('Rolling back %s' % part)
+                os.remove(part)
+        if len(dataset_parts(dataset)) != len(parts):
+            raise StateError('Parts of %s are missing' % dataset)
+
+    def new_records(self, response_records):
+        """Yield the records created after the watermark and advance it."""
+        previous = self.watermark
+        previous_ids = self.watermark_ids
+
+        for record in response_records:
+            created_at = epoch(record['created_at'])
+            if previous is not None:
+                if created_at < previous:
+                    continue
+                if created_at == previous and str(record['id']) in previous_ids:
+                    continue
+
+            if self.watermark is None or created_at > self.watermark:
+                self.watermark = created_at
+                self.watermark_ids = set()
+            if created_at == self.watermark:
+                self.watermark_ids.add(str(record['id']))
+
+            yield record
+
+    def save(self, rows_written, parts_written=None):
+        for file_key, rows in rows_written.items():
+            previous = self.files.get(file_key, {'rows': 0, 'parts': []})
+            self.files[file_key] = {
+                'rows': previous['rows'] + rows,
+                'size': os.path.getsize(self.filename(file_key)),
+                'parts': previous['parts'],
+            }
+
+        # Parquet datasets are only complete if every run wrote them.
+        for file_key, written in self.files.items():
+            if parts_written is None:
+                written['parts'] = None
+            elif file_key in parts_written:
+                written['parts'] = parts_written[file_key]
+
+        state = {
+            'version': STATE_VERSION,
+            'watermark': {
+                'created_at': self.watermark,
+                'ids': sorted(self.watermark_ids),
+            },
+            'files': self.files,
+            'submission_index': self.submission_index.counters,
+            'health_per_day': self.health.state(self.path + DIGESTS_SUFFIX),
+        }
+
+        partial = self.path + '.partial'
+        with open(partial, 'w') as outfile:
+            json.dump(state, outfile)
+        os.replace(partial, self.path)
@@ -0,0 +1,184 @@
+
+#
+# Stroop analytics for the notebook.
+#
+# The script writes the scores of the sessions (see score_stroop()) and
+# their interactions as a long table, a row per interaction
+# (task-at_stroopeffect-interactions). wide_view() joins the first 30 of
+# each session to the rows of the sessions as the Inter<i>_Date_Time,
+# _Correct, _Color and _Spelling columns.
+#
+# The 30 interaction slots of a session are taken as (sessions x 30)
+# arrays, so the times between the taps, the correctness and congruency
+# of every interaction and the per-session scores are computed a whole
+# column block at a time:
+#
+#   wide_view()     the sessions with their interaction slots
+#   clean_stroop()  stroop_clean, without scores unless the script wrote
+#                   them: Inter<i>_Correct as
+#                   booleans and the seconds since the previous tap (or
+#                   the start of the task) as Inter<i>_Time
+#   score_stroop()  adds Average_Speed, the congruent/incongruent totals
+#                   and percentages, the mean times and their difference,
+#                   for files without the scores of the script
+#   basic_stroop()  the stroop_basic view of the scores
+#
+# clean_stroop() accepts the CSV rows (ISO strings, 'Correct gesture')
+# as well as the typed Parquet rows (timestamps, booleans).
+#
+
+import numpy as np
+import pandas as pd
+
+from qc1np.schemas import (
+    GESTURES,
+    STROOP_COLUMNS,
+    STROOP_INTERACTIONS,
+    STROOP_SCORE_COLUMNS,
+    TRAILING_COLUMNS,
+)
+
+SLOTS = range(1, STROOP_INTERACTIONS + 1)
+
+SLOT_FIELDS = ['Date_Time', 'Correct', 'Color', 'Spelling']
+
+TIME_COLUMNS = [f'Inter{i}_Time' for i in SLOTS]
+
+CLEAN_COLUMNS = [
+    'Participant_NR',
+    'Session',
+    'Participant_ID',
+    'app_version',
+    'study_version',
+    'time_start',
+    'timezone',
+    'submitted_at',
+    'Date_as_Number',
+] + list(STROOP_COLUMNS) + TIME_COLUMNS
+
+SCORE_COLUMNS = list(STROOP_SCORE_COLUMNS)
+
+BASIC_COLUMNS = ['Participant_NR', 'Participant_ID', 'Date_as_Number'] + SCORE_COLUMNS
+
+
+def wide_view(sessions, interactions, slots=STROOP_INTERACTIONS):
+    """The rows of the stroop file with the Inter<i>_* columns of the
+    first ``slots`` interactions of each session, before the trailing
+    columns. Slots of sessions with fewer interactions are missing.
+    """
+    shown = interactions[interactions['Interaction'] <= slots]
+    # A response that is in the export twice has its interactions twice.
+    shown = shown.drop_duplicates(['id', 'Interaction'])
+
+    wide = shown.pivot(index='id', columns='Interaction', values=SLOT_FIELDS)
+    wide.columns = [f'Inter{i}_{field}' for field, i in wide.columns]
+    slot_columns = [f'Inter{i}_{field}' for i in range(1, slots + 1) for field in SLOT_FIELDS]
+    wide = wide.reindex(columns=slot_columns)
+
+    view = sessions.join(wide, on='id')
+    names = [name for name in sessions.columns if name not in TRAILING_COLUMNS]
+    names.extend(slot_columns)
+    names.extend(name for name in TRAILING_COLUMNS if name in sessions.columns)
+    return view[names]
+
+
+def clean_stroop(df):
+    """stroop_clean from the rows of the stroop file.
+
+    ``df`` needs a Participant_NR column (see id_to_number()). A time
+    is NaN when the tap or the one before it is missing.
+    """
+    starts = _seconds(df['time_start'])
+    taps = np.column_stack([_seconds(df[f'Inter{i}_Date_Time']) for i in SLOTS])
+    times = np.round(np.diff(np.column_stack([starts, taps]), axis=1), 3)
+
+    clean = df.rename({'submission_index': 'Session', 'participant': 'Participant_ID'}, axis=1)
+    clean = pd.concat([
+        clean.drop(columns=[f'Inter{i}_Correct' for i in SLOTS]),
+        pd.DataFrame({f'Inter{i}_Correct': _correct(df[f'Inter{i}_Correct']) for i in SLOTS}),
+        pd.DataFrame(times, columns=TIME_COLUMNS, index=df.index),
+    ], axis=1)[CLEAN_COLUMNS + [name for name in SCORE_COLUMNS if name in df]]
+
+    return clean.sort_values(by=['Participant_NR', 'Session'])
+
+
+def score_stroop(clean):
+    """Add the scores of each session to the output of clean_stroop().
+
+    Sessions scored by the script (over all of their interactions, not
+    only those of the slots) keep their scores.
+    """
+    if all(name in clean for name in SCORE_COLUMNS):
+        return clean
+
+    answers = _block(clean, 'Correct').astype('boolean')
+    color = _block(clean, 'Color').to_numpy(dtype=object)
+    spelling = _block(clean, 'Spelling').to_numpy(dtype=object)
+    times = _block(clean, 'Time').to_numpy(dtype=float)
+
+    # Only interactions with an answer, a color and a spelling count.
+    filled = (
+        answers.notna().to_numpy()
+        & pd.notna(color)
+        & pd.notna(spelling)
+    )
+    correct = filled & answers.fillna(False).to_numpy(dtype=bool)
+    incorrect = filled & ~correct
+    congruent = filled & (color == spelling)
+    incongruent = filled & ~congruent
+
+    scores = pd.DataFrame(index=clean.index)
+    scores['Average_Speed'] = np.round(_nanmean(times, np.ones_like(filled)), 2)
+
+    totals = {
+        'Congruent_Correct': congruent & correct,
+        'Congruent_Incorrect': congruent & incorrect,
+        'Incongruent_Correct': incongruent & correct,
+        'Incongruent_Incorrect': incongruent & incorrect,
+    }
+    for name, mask in totals.items():
+        scores[f'{name}_Total'] = mask.sum(axis=1)
+
+    answered = filled.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name in totals:
+            scores[f'{name}_Perc'] = np.round(scores[f'{name}_Total'] / answered * 100, 2)
+
+    # The mean times are those of the correct answers only.
+    scores['Congruent_Time_Mean'] = np.round(_nanmean(times, totals['Congruent_Correct']), 3)
+    scores['Incongruent_Time_Mean'] = np.round(_nanmean(times, totals['Incongruent_Correct']), 3)
+    scores['Mean_Time_Difference'] = np.round(
+        scores['Incongruent_Time_Mean'] - scores['Congruent_Time_Mean'], 3
+    )
+
+    return pd.concat([clean, scores], axis=1)
+
+
+def basic_stroop(scored):
+    """stroop_basic: the scores of each session without the interactions."""
+    return scored[BASIC_COLUMNS]
+
+
+def _seconds(values):
+    """Seconds since the epoch of ISO strings or timestamps; NaN if missing."""
+    moments = pd.to_datetime(values, utc=True, format='ISO8601')
+    seconds = (moments - pd.Timestamp(0, tz='UTC')) / pd.Timedelta(seconds=1)
+    return seconds.to_numpy(dtype=float, na_value=np.nan)
+
+
+def _correct(values):
+    # Booleans (Parquet) are kept, gestures (CSV) are mapped.
+    return values.map({**GESTURES, True: True, False: False}).astype('boolean')
+
+
+def _block(df, name):
+    return df[[f'Inter{i}_{name}' for i in SLOTS]]
+
+
+def _nanmean(values, mask):
+    # The mean of the values selected by mask, skipping missing times;
+    # NaN when nothing is left.
+    selected = mask & ~np.isnan(values)
+    count = selected.sum(axis=1)
+    total = np.where(selected, values, 0.0).sum(axis=1)
+    return np.where(count > 0, total / np.maximum(count, 1), np.nan)
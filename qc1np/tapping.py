@@ -0,0 +1,184 @@
+
+#
+# Batch scoring of tapping sessions, for re-scoring the whole history
+# when the scoring rules change.
+#
+# The taps of all sessions are taken as flat arrays, the taps of session
+# s being those from offsets[s] to offsets[s + 1]:
+#
+#   offsets  int array of the sessions + 1 bounds
+#   codes    int array, a code per distinct description (see
+#            encode_descriptions()); equal descriptions, equal codes
+#   hands    int array, the RIGHT/LEFT of each code or -1
+#   times    datetime64 array of the taps, NaT when missing
+#
+# score_taps() compares every tap with the one before it (shifted
+# arrays) and adds the results up per session (np.bincount and ufunc
+# reductions), so there is no Python loop over the sessions or taps. The
+# result has the TAPPING_COLUMNS of qc1np.transform.TapScore, per
+# session:
+#
+#   ids, arrays = tap_arrays(iter_records(open('qc-service_response-1np-alldata-20210412.json')))
+#   scores = score_taps(*arrays)
+#
+# The means and standard deviations are added up in another order than
+# TapScore does, so they can differ in the last place before rounding.
+#
+
+import numpy as np
+import pandas as pd
+
+from qc1np.ingest import select_activities
+from qc1np.schemas import TAPPING_COLUMNS, TAPPING_COUNT_COLUMNS
+from qc1np.transform import LEFT, RIGHT, tap_hand
+
+MICROSECONDS = 1e6
+
+# The int64 of NaT.
+NAT = np.iinfo(np.int64).min
+
+
+def encode_descriptions(descriptions):
+    """The codes of ``descriptions`` and the hand (RIGHT, LEFT or -1) of
+    each code.
+    """
+    codes, uniques = pd.factorize(pd.Series(descriptions, dtype=object), use_na_sentinel=False)
+    hands = np.array([
+        _hand(description) for description in uniques
+    ], dtype=np.int64)
+    return codes.astype(np.int64), hands
+
+
+def tap_arrays(records):
+    """The ids of the tapping responses among ``records`` and the
+    (offsets, codes, hands, times) of their taps for score_taps().
+    """
+    ids = []
+    lengths = []
+    descriptions = []
+    times = []
+    for record in select_activities(records, ['at_tapping']):
+        try:
+            interactions = record.data['results']['at_tapping']['interactions']
+        except (KeyError, TypeError, ValueError):
+            continue
+        ids.append(record['id'])
+        lengths.append(len(interactions))
+        for interaction in interactions:
+            descriptions.append(interaction.get('description'))
+            times.append(interaction.get('time'))
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    codes, hands = encode_descriptions(descriptions)
+    moments = pd.to_datetime(pd.Series(times, dtype=object), utc=True, format='ISO8601', errors='coerce')
+    return ids, (offsets, codes, hands, moments.dt.tz_localize(None).to_numpy('datetime64[us]'))
+
+
+def score_taps(offsets, codes, hands, times):
+    """The TAPPING_COLUMNS of every session, a row per session."""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    codes = np.asarray(codes, dtype=np.int64)
+    sessions = len(offsets) - 1
+    lengths = np.diff(offsets)
+    session = np.repeat(np.arange(sessions), lengths)
+    hand = np.asarray(hands, dtype=np.int64)[codes]
+    micros = np.asarray(times, dtype='datetime64[us]').view(np.int64)
+    timed = micros != NAT
+
+    # Every tap but the first of its session, compared with the one before.
+    follows = np.ones(len(codes), dtype=bool)
+    follows[offsets[:-1][lengths > 0]] = False
+    same = np.zeros(len(codes), dtype=bool)
+    same[1:] = codes[1:] == codes[:-1]
+    same &= follows
+
+    scores = {}
+    for name, mask in [
+        ('Correct_Right_Hand', follows & ~same & (hand == RIGHT)),
+        ('Correct_Left_Hand', follows & ~same & (hand == LEFT)),
+        ('Incorrect_Right_Hand', same & (hand == RIGHT)),
+        ('Incorrect_Left_Hand', same & (hand == LEFT)),
+        ('Missing_data', follows & (hand < 0)),
+    ]:
+        scores[name] = _count(session[mask], sessions)
+    scores['Taps'] = lengths
+
+    # An error run starts at a repeated tap whose predecessor was not one.
+    starts = same.copy()
+    starts[1:] &= ~same[:-1]
+    scores['Error_Runs'] = _count(session[starts], sessions)
+    runs = np.bincount(np.cumsum(starts)[same] - 1, minlength=np.count_nonzero(starts))
+    longest = _extreme(np.fmax, session[starts], runs.astype(float), sessions)
+    scores['Longest_Error_Run'] = np.nan_to_num(longest)
+
+    # The seconds since the tap before, if both have a time.
+    between = np.zeros(len(codes), dtype=bool)
+    between[1:] = timed[1:] & timed[:-1]
+    between &= follows
+    intervals = np.zeros(len(codes))
+    intervals[1:] = (micros[1:] - micros[:-1]) / MICROSECONDS
+    count, mean, sd = _moments(session[between], intervals[between], sessions)
+    scores['Tap_Interval_Mean'] = np.round(mean, 3)
+    scores['Tap_Interval_SD'] = np.round(sd, 3)
+    scores['Tap_Interval_Min'] = np.round(_extreme(np.fmin, session[between], intervals[between], sessions), 3)
+    scores['Tap_Interval_Max'] = np.round(_extreme(np.fmax, session[between], intervals[between], sessions), 3)
+
+    # Over the span from the first to the last tap with a time.
+    positions = np.arange(len(codes))
+    first = _extreme(np.fmin, session[timed], positions[timed].astype(float), sessions)
+    last = _extreme(np.fmax, session[timed], positions[timed].astype(float), sessions)
+    has_span = ~np.isnan(first)
+    span = np.full(sessions, np.nan)
+    span[has_span] = (micros[last[has_span].astype(np.int64)] - micros[first[has_span].astype(np.int64)]) / MICROSECONDS
+    timed_taps = _count(session[timed], sessions)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores['Taps_Per_Second'] = np.where(
+            (timed_taps > 1) & (span > 0), np.round((timed_taps - 1) / span, 2), np.nan,
+        )
+
+    # Per hand, the seconds between its own taps with a time.
+    for name, side in [('Right_Hand_Interval_CV', RIGHT), ('Left_Hand_Interval_CV', LEFT)]:
+        taps = np.flatnonzero(timed & (hand == side))
+        pairs = session[taps[1:]] == session[taps[:-1]]
+        own = (micros[taps[1:]] - micros[taps[:-1]])[pairs] / MICROSECONDS
+        count, mean, sd = _moments(session[taps[1:]][pairs], own, sessions)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scores[name] = np.where(mean > 0, np.round(sd / mean, 3), np.nan)
+
+    frame = pd.DataFrame(scores)[list(TAPPING_COLUMNS)]
+    return frame.astype({name: 'int64' for name in TAPPING_COUNT_COLUMNS})
+
+
+def _hand(description):
+    if not isinstance(description, str):
+        return -1
+    hand = tap_hand(description)
+    return -1 if hand is None else hand
+
+
+def _count(session, sessions):
+    return np.bincount(session, minlength=sessions).astype(np.int64)
+
+
+def _moments(session, values, sessions):
+    # The count, mean and sample standard deviation of the values of each
+    # session; NaN where there are too few.
+    count = np.bincount(session, minlength=sessions)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(session, values, minlength=sessions) / count
+        squares = np.bincount(session, (values - mean[session]) ** 2, minlength=sessions)
+        sd = np.sqrt(squares / (count - 1))
+    mean[count == 0] = np.nan
+    sd[count < 2] = np.nan
+    return count, mean, sd
+
+
+def _extreme(ufunc, session, values, sessions):
+    # ufunc (np.fmin or np.fmax) of the values of each session, NaN for
+    # sessions without any. ``session`` is sorted.
+    result = np.full(sessions, np.nan)
+    if len(values):
+        starts = np.flatnonzero(np.r_[True, session[1:] != session[:-1]])
+        result[session[starts]] = ufunc.reduceat(values, starts)
+    return result
@@ -0,0 +1,76 @@
+
+#
+# Parsing of the ISO-8601 timestamps of the export.
+#
+# The same strings are parsed many times: the dateFrom and dateTo of a
+# health data block are needed for the sums per day, for the first and
+# last moment of an upload and again for the per-day table, and every
+# upload repeats the blocks of the days before. parse_timestamp() parses
+# a string once and keeps the result in a bounded LRU cache.
+#
+# Timestamps without an offset are read as UTC so results never depend
+# on the machine running the script.
+#
+
+import functools
+import math
+from collections import namedtuple
+from datetime import datetime, timezone
+
+PARSE_CACHE_SIZE = 16384
+
+
+class Timestamp(namedtuple('Timestamp', ['datetime', 'epoch'])):
+    """A parsed timestamp: the (timezone aware) datetime and the seconds
+    since the epoch.
+    """
+    __slots__ = ()
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_timestamp(value):
+    """Parse an ISO-8601 string; raises ValueError if it is not one."""
+    moment = _parse(value)
+    return Timestamp(moment, moment.timestamp())
+
+
+def moment(value):
+    """The datetime of an ISO-8601 string, or None if there is none.
+
+    Not cached: meant for the times of the interactions of a task, which
+    are all different and would only push the others out of the cache.
+    """
+    if not value:
+        return None
+    try:
+        return _parse(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def epoch(value):
+    """Seconds since the epoch of an ISO-8601 string, or infinity if there is none."""
+    if not value:
+        return math.inf
+    try:
+        return parse_timestamp(value).epoch
+    except (TypeError, ValueError):
+        return math.inf
+
+
+def seconds_between(start, end):
+    """Seconds from ``start`` to ``end`` (datetimes from moment()) rounded
+    to the millisecond, or None if either is None.
+    """
+    if start is None or end is None:
+        return None
+    return round((end - start).total_seconds(), 3)
+
+
+def _parse(value):
+    if value[-1:] == 'Z':
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
@@ -0,0 +1,180 @@
+
+#
+# Calendar days in the timezone of a participant.
+#
+# A health data block (dateFrom - dateTo) that spans midnight belongs to
+# more than one day. DayBoundaries splits the value of such a block over
+# the days it covers, in proportion to the time spent in each day, using
+# the local midnights of the timezone of the participant's device.
+#
+# The midnights are computed once per timezone and day and kept in a
+# sorted list, so a block costs a bisect plus one step per day it
+# covers, however long the upload is.
+#
+# The same midnights give the Date_as_Number of a response: local_day()
+# for one timestamp in the script and local_days() for a whole column in
+# the notebook, so both produce the same day keys whatever the timezone
+# of the machine running them.
+#
+
+import functools
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import numpy as np
+
+from qc1np.timestamps import epoch, parse_timestamp
+
+ONE_DAY = timedelta(days=1)
+
+
+class DayBoundaries:
+    """The local midnights of ``tz``, extended as blocks ask for them."""
+
+    def __init__(self, tz):
+        self.tz = tz
+        self.first = None
+        # midnights[i] starts days[i]; the last midnight ends the last day
+        self.midnights = []
+        self.days = []
+
+    def split(self, start, end, value):
+        """Yield (day, share of value) for every day the block covers.
+
+        ``start`` and ``end`` are seconds since the epoch, ``day`` is the
+        local date as YYYYMMDD. A block without duration counts for the
+        day it starts in.
+        """
+        self._cover(start, max(start, end))
+        i = bisect_right(self.midnights, start) - 1
+
+        if end <= start or end <= self.midnights[i + 1]:
+            yield self.days[i], value
+            return
+
+        duration = end - start
+        remaining = value
+        while end > self.midnights[i + 1]:
+            share = value * (self.midnights[i + 1] - start) / duration
+            remaining -= share
+            yield self.days[i], share
+            start = self.midnights[i + 1]
+            i += 1
+        # The last day gets what is left so the shares add up to value.
+        yield self.days[i], remaining
+
+    def day(self, moment):
+        """The local date (YYYYMMDD) of ``moment`` in seconds since the epoch."""
+        self._cover(moment, moment)
+        return self.days[bisect_right(self.midnights, moment) - 1]
+
+    def days_of(self, moments):
+        """day() of an array of moments, with one searchsorted."""
+        self._cover(moments.min(), moments.max())
+        found = np.searchsorted(self.midnights, moments, side='right') - 1
+        return np.array(self.days, dtype=object)[found]
+
+    def _cover(self, start, end):
+        first = datetime.fromtimestamp(start, self.tz).date()
+        last = datetime.fromtimestamp(end, self.tz).date()
+
+        if self.first is None:
+            self.first = first
+            self.midnights = [self._midnight(first), self._midnight(first + ONE_DAY)]
+            self.days = [first.strftime('%Y%m%d')]
+
+        if first < self.first:
+            earlier = [first + ONE_DAY * i for i in range((self.first - first).days)]
+            self.midnights[:0] = [self._midnight(day) for day in earlier]
+            self.days[:0] = [day.strftime('%Y%m%d') for day in earlier]
+            self.first = first
+
+        day = self.first + ONE_DAY * len(self.days)
+        while day <= last:
+            self.midnights.append(self._midnight(day + ONE_DAY))
+            self.days.append(day.strftime('%Y%m%d'))
+            day += ONE_DAY
+
+    def _midnight(self, day):
+        return datetime(day.year, day.month, day.day, tzinfo=self.tz).timestamp()
+
+
+@functools.lru_cache(maxsize=None)
+def day_boundaries(tz):
+    """The shared DayBoundaries of ``tz``."""
+    return DayBoundaries(tz)
+
+
+def participant_timezone(name, moment):
+    """The timezone called ``name`` (e.g. 'Europe/Amsterdam').
+
+    Falls back on the UTC offset of the ISO-8601 string ``moment`` (or
+    UTC) when the device did not report a timezone the system knows.
+    """
+    zone = _zone(name)
+    if zone is None:
+        return parse_timestamp(moment).datetime.tzinfo
+    return zone
+
+
+def local_day(moment, name):
+    """The Date_as_Number (YYYYMMDD) of the ISO-8601 string ``moment`` in
+    the timezone called ``name``.
+    """
+    return day_boundaries(participant_timezone(name, moment)).day(parse_timestamp(moment).epoch)
+
+
+def local_days(moments, names):
+    """local_day() for a column of moments and a column of timezone names.
+
+    The moments may be ISO-8601 strings or (aware) datetimes, as read
+    from the CSV files or the Parquet datasets. Returns an array of day
+    keys, None where the moment is missing.
+    """
+    moments = list(moments)
+    names = list(names)
+    seconds = np.array([_seconds(moment) for moment in moments])
+    days = np.full(len(moments), None, dtype=object)
+
+    # One searchsorted over the midnights of each timezone.
+    groups = {}
+    for i, (moment, name) in enumerate(zip(moments, names)):
+        if np.isfinite(seconds[i]):
+            zone = _zone(name)
+            if zone is None:
+                zone = _offset(moment)
+            groups.setdefault(zone, []).append(i)
+
+    for zone, positions in groups.items():
+        days[positions] = day_boundaries(zone).days_of(seconds[positions])
+
+    return days
+
+
+@functools.lru_cache(maxsize=None)
+def _zone(name):
+    # None for names the system does not know, so failed lookups are
+    # cached as well.
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, TypeError, ValueError):
+        return None
+
+
+def _seconds(moment):
+    if isinstance(moment, datetime):
+        try:
+            return moment.timestamp()
+        except ValueError:
+            # NaT
+            return np.inf
+    if isinstance(moment, str):
+        return epoch(moment)
+    return np.inf
+
+
+def _offset(moment):
+    if isinstance(moment, datetime):
+        return moment.tzinfo or timezone.utc
+    return parse_timestamp(moment).datetime.tzinfo
@@ -0,0 +1,693 @@
+
+#
+# Transformation of the response records of an export into the rows of
+# the qc-responses-1nP-<file_key>.csv files.
+#
+# transform_record() turns one record into its parsed record (the row of
+# its own file) and the rows it adds to derived tables. The activity
+# specific fields are filled in by the processors registered below with
+# @register() (qc1np.processors).
+#
+# The hotfix script writes the rows to files; qc1np.frames.transform_export()
+# collects them in memory for the notebook.
+#
+
+import functools
+import math
+import re
+import sys
+import traceback
+from datetime import datetime, timezone
+
+from qc1np.ingest import LazyRecord, cache_stats as decoding_cache_stats
+from qc1np.processors import register, resolve
+from qc1np.schemas import (
+    GESTURES,
+    HEALTHDATA_TYPE_COLUMNS,
+    STROOP_SCORE_COLUMNS,
+    TAPPING_COLUMNS,
+)
+from qc1np.timestamps import moment, parse_timestamp, seconds_between
+from qc1np.timezones import day_boundaries, local_day, participant_timezone
+
+RESPONSE_TYPES = {
+    1: 'questionnaire',
+    2: 'task',
+    3: 'healthdata',
+}
+
+# The pattern can be compiled before looping over each record. This
+# is a small but not-insignificant performance improvement and is
+# easier to catch exceptions here vs during a match.
+STROOP_PATTERN = re.compile(
+    r"""^.+(Green|Red|Yellow|Blue).+(Green|Red|Yellow|Blue).+\s(\d+)\s*$""",
+    re.IGNORECASE
+)
+
+# Distinct Stroop descriptions kept parsed. There are only a few: 4
+# colours x 4 spellings x the word counts.
+DESCRIPTION_CACHE_SIZE = 4096
+
+STROOP_COLORS = ('green', 'red', 'yellow', 'blue')
+
+
+@functools.lru_cache(maxsize=DESCRIPTION_CACHE_SIZE)
+def parse_description(description):
+    """The (color, spelling, total_words) of a Stroop interaction
+    description as STROOP_PATTERN matches them, or None.
+    """
+    if isinstance(description, str) and description.isascii() and '\n' not in description:
+        return _scan_description(description)
+    matcher = STROOP_PATTERN.match(description)
+    return matcher.groups() if matcher else None
+
+
+def _scan_description(description):
+    # STROOP_PATTERN without backtracking, for ASCII descriptions on a
+    # single line. Its greedy .+ make the words the digits at the end
+    # (after whitespace), the spelling the last colour before those and
+    # the colour the last one before the spelling, with at least one
+    # character before, between and after the colours.
+    text = description.rstrip()
+    end = len(text)
+    start = end
+    while start > 0 and text[start - 1].isdigit():
+        start -= 1
+    if start == end or start == 0 or not text[start - 1].isspace():
+        return None
+
+    lowered = text.lower()
+    spelling = _last_color(lowered, 2, start - 2)
+    if spelling is None:
+        return None
+    color = _last_color(lowered, 1, spelling[0] - 1)
+    if color is None:
+        return None
+
+    return (
+        description[color[0]:color[1]],
+        description[spelling[0]:spelling[1]],
+        text[start:end],
+    )
+
+
+def _last_color(lowered, first, stop):
+    # (start, end) of the colour starting last in lowered[first:stop].
+    found = None
+    for color in STROOP_COLORS:
+        position = lowered.rfind(color, first, stop)
+        if position >= 0 and (found is None or position > found[0]):
+            found = (position, position + len(color))
+    return found
+
+
+# The hands of tap_hand().
+RIGHT = 0
+LEFT = 1
+
+# Distinct tap descriptions kept classified ('Tapped left button', ...).
+TAP_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=TAP_CACHE_SIZE)
+def tap_hand(description):
+    """RIGHT or LEFT, the hand of a tapping interaction description, or None."""
+    description = description.lower()
+    if ' right ' in description:
+        return RIGHT
+    if ' left ' in description:
+        return LEFT
+    return None
+
+
+def cache_stats():
+    """The hits and misses of the decoding and parsing caches in this
+    process.
+    """
+    caches = decoding_cache_stats()
+    caches['description'] = parse_description.cache_info()
+    caches['tap'] = tap_hand.cache_info()
+    return caches
+
+
+def transform_record(record, stats=None):
+    """Return the parsed record, the (file_key, row) pairs it adds to other
+    files and the number of parts that failed to parse. The time spent in
+    the activity processor is counted in ``stats`` (a ProcessorStats).
+    """
+    skipped = 0
+    extra_rows = []
+
+    if not isinstance(record, LazyRecord):
+        record = LazyRecord(record)
+
+    pid = record['participant_id']
+    rtype = RESPONSE_TYPES[int(record['response_type'])]
+    parsed_record = {
+        'id': record['id'],
+        'participant': pid,
+        'response_type': rtype,
+    }
+
+    try:
+        if 'study' in record:
+            study = record.study
+            parsed_record['study'] = study['short_name']
+            parsed_record['study_version'] = study['version']
+
+    except Exception as ex:
+        traceback.print_exc()
+        # elog('%s\n' % study)
+        skipped += 1
+        next
+
+    try:
+        if 'metadata' in record:
+            metadata = record.metadata
+            # Responses without an activity get 'all'. This is used in the
+            # file name for this response type + activity combo so it
+            # looks reasonable as demo output.
+            parsed_record['activity'] = record.activity
+            if 'app' in metadata:
+                parsed_record['app_version'], parsed_record['timezone'] = record.app
+
+    except Exception as ex:
+        elog(ex)
+        traceback.print_exc()
+        # elog('%s\n' % metadata)
+        skipped += 1
+        next
+
+    # Add the submitted date as recorded by the database after the metadata
+    # and before the data which includes dates at the start.
+    parsed_record['received_at'] = record['created_at']
+
+    try:
+        if 'data' in record:
+            data = record.data
+            # The processors are registered below with @register().
+            processor = resolve(rtype, record.activity)
+            if processor is not None:
+                if stats is None:
+                    rows = processor(data, parsed_record)
+                else:
+                    rows = stats.run(processor, data, parsed_record)
+                if rows:
+                    extra_rows.extend(rows)
+
+    except Exception as ex:
+        traceback.print_exc()   
+        # elog('%s\n' % data)
+        # elog()
+        skipped += 1
+        next
+
+    return parsed_record, extra_rows, skipped
+
+
+def record_rows(parsed_record, extra_rows, submission_index, participants, health, compact):
+    """Yield the (file_key, row) pairs a transformed record adds to the
+    files: its own row, numbered, and the rows of the derived tables. The
+    health data blocks are counted in ``health`` (see per_day_rows()).
+
+    Raises qc1np.rows.UnexpectedFields before anything is yielded or
+    counted if a row has fields that are not columns of its file.
+    """
+    file_key = '%s-%s' % (
+        parsed_record['response_type'],
+        parsed_record['activity'],
+    )
+    compact.check(file_key, parsed_record)
+    for extra_key, row in extra_rows:
+        if extra_key != 'healthdata-per-day':
+            compact.check(extra_key, row)
+
+    # Keep track of the number of times the participant
+    # has completed this activity.
+    parsed_record['submission_index'] = submission_index.assign(file_key, parsed_record)
+    parsed_record['Participant_NR'] = participants.number(parsed_record['participant'])
+
+    # The writers keep the compact row, not the dict.
+    yield file_key, compact(file_key, parsed_record)
+
+    for extra_key, row in extra_rows:
+        if extra_key == 'healthdata-per-day':
+            health.add(row)
+            continue
+        row['Participant_NR'] = parsed_record['Participant_NR']
+        yield extra_key, compact(extra_key, row)
+
+
+def per_day_rows(health, participants, compact):
+    """Yield the ('healthdata-per-day', row) pairs of the health data
+    counted so far, ordered by Participant_NR.
+    """
+    rows = list(health.rows())
+    for row in rows:
+        row['Participant_NR'] = participants.number(row['participant'])
+    rows.sort(key=lambda row: row['Participant_NR'])
+
+    for row in rows:
+        yield 'healthdata-per-day', compact('healthdata-per-day', row)
+
+
+def elog(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def dlog(*args, **kwargs):
+    # TODO: replace with PYTHON_DEBUG (2021.03.24)
+    if False:
+        print(*args, file=sys.stderr, **kwargs)
+
+
+def _process_timestamps(data, parsed_record):
+    parsed_record['time_start'] = data['timestamps']['start']
+    parsed_record['time_end'] = data['timestamps']['end']
+    parsed_record['time_scheduled_start'] = data['timestamps']['scheduled_start']
+    parsed_record['time_scheduled_end'] = data['timestamps']['scheduled_end']
+    parsed_record['submitted_at'] = data['timestamps']['submitted']
+    # The day the activity started in the timezone of the participant's
+    # device, not in that of the machine running this script.
+    parsed_record["Date_as_Number"] = local_day(data['timestamps']['start'], parsed_record.get('timezone'))
+
+
+@register('questionnaire', 'qes_intake')
+def _process_intake(data, parsed_record):
+    _process_timestamps(data, parsed_record)
+    baseline_question_groups = ["Basic Demographic Information","Basic Medical Information","blood_circulation_problems",
+    "blood_circulation_type","heart_vascular_disorders","heart_vascular_type","musculoskeletal_concerns","musculoskeletal_type",
+    "respiratory_concerns","respiratory_type","symptoms_list"]
+    for baseline_question_group_key in baseline_question_groups:
+        try:
+            results_of_group = data["results"][baseline_question_group_key]["results"]
+            for baseline_question_key in results_of_group:
+                baseline_question = results_of_group[baseline_question_key]
+                parsed_record[baseline_question_key] = baseline_question["results"]["answer"][0]["text"]
+        except KeyError:
+            parsed_record[baseline_question_group_key] = None
+
+@register('questionnaire', 'qes_final')
+def _process_unsupported(data, parsed_record):
+    print("Not supported")
+
+
+@register('questionnaire', 'qes_gad7')
+@register('questionnaire', 'qes_phq9')
+@register('questionnaire', 'qes_panas10')
+@register('questionnaire')
+def _process_mood_questionnaires(data, parsed_record):
+    _process_timestamps(data, parsed_record)
+    results = {}
+    try:
+        results = data["results"]["Questions"]["results"]
+    except KeyError:
+        print(parsed_record['activity'])
+
+    try:
+        results["question10"] = data["results"]["Questions 2"]["results"]["question10"]
+    except KeyError:
+        pass
+
+    for question_key in results:
+        question = results[question_key]
+        parsed_record[question_key] = question["results"]["answer"][0]["text"]
+
+@register('task', 'at_stroopeffect')
+def _process_task_stroop(data, parsed_record):
+    _process_timestamps(data, parsed_record)
+    interactions = data["results"]["at_stroopeffect"]["interactions"]
+
+    # One row per interaction, as many as the session has, in the
+    # task-at_stroopeffect-interactions table. qc1np.stroop.wide_view()
+    # gives the Inter<i>_* columns of the sessions. The scores of the
+    # session are added up along the way.
+    rows = []
+    score = StroopScore()
+    # The parsed time of the previous interaction, so every time is only
+    # parsed once.
+    previous = moment(parsed_record['time_start'])
+    for i, interaction in enumerate(interactions, 1):
+        if interaction['time']:
+            date_time = interaction['time']
+        else:
+            date_time = None
+
+        # Parse the description (the same few strings over and over); an
+        # interaction without one has no colour and spelling.
+        description = interaction.get('description')
+        parsed = parse_description(description) if description else None
+        # A 3 element tuple
+        if parsed:
+            # => ('Red', 'Blue', '99')
+            color, spelling = parsed[0], parsed[1]
+        else:
+            color = spelling = None
+
+        correctness = interaction['correctness']
+        answered = moment(date_time)
+        time = seconds_between(previous, answered)
+        rows.append(('task-at_stroopeffect-interactions', {
+            'id': parsed_record['id'],
+            'Interaction': i,
+            'Date_Time': date_time,
+            'Correct': correctness,
+            'Color': color,
+            'Spelling': spelling,
+            'Time': time,
+        }))
+        previous = answered
+
+        answer = GESTURES.get(correctness) if isinstance(correctness, str) else None
+        score.add(time, answer, color, spelling)
+
+    parsed_record.update(score.columns())
+    return rows
+
+
+class StroopScore:
+    """The scores of a Stroop session, added up an interaction at a time.
+
+    They are those of qc1np.stroop.score_stroop(): only interactions with
+    an answer, a colour and a spelling count, and the mean times are
+    those of the correct answers.
+    """
+
+    def __init__(self):
+        self.time = 0.0
+        self.timed = 0
+        # Congruent correct, congruent incorrect, incongruent correct and
+        # incongruent incorrect.
+        self.totals = [0, 0, 0, 0]
+        # Of the correct congruent and incongruent answers.
+        self.correct_time = [0.0, 0.0]
+        self.correct_timed = [0, 0]
+
+    def add(self, time, answer, color, spelling):
+        """Count an interaction; ``time`` (seconds since the one before) and
+        ``answer`` (True if correct) are None when missing.
+        """
+        if time is not None:
+            self.time += time
+            self.timed += 1
+        if answer is None or color is None or spelling is None:
+            return
+
+        incongruent = color != spelling
+        self.totals[2 * incongruent + (not answer)] += 1
+        if answer and time is not None:
+            self.correct_time[incongruent] += time
+            self.correct_timed[incongruent] += 1
+
+    def columns(self):
+        """The STROOP_SCORE_COLUMNS and their values."""
+        answered = sum(self.totals)
+        congruent = _mean(self.correct_time[0], self.correct_timed[0], 3)
+        incongruent = _mean(self.correct_time[1], self.correct_timed[1], 3)
+        if congruent is None or incongruent is None:
+            difference = None
+        else:
+            difference = round(incongruent - congruent, 3)
+
+        values = [_mean(self.time, self.timed, 2)]
+        values.extend(self.totals)
+        values.extend(
+            round(total / answered * 100, 2) if answered else None
+            for total in self.totals
+        )
+        values.extend([congruent, incongruent, difference])
+        return zip(STROOP_SCORE_COLUMNS, values)
+
+
+def _mean(total, count, digits):
+    if not count:
+        return None
+    return round(total / count, digits)
+
+
+@register('task', 'at_tapping')
+def _process_task_tapping(data, parsed_record):
+    _process_timestamps(data, parsed_record)
+    interactions = data["results"]["at_tapping"]["interactions"]
+
+    score = TapScore()
+    for interaction in interactions:
+        score.add(interaction['description'], interaction.get('time'))
+    parsed_record.update(score.columns())
+
+
+class TapScore:
+    """The scores of a tapping session, added up a tap at a time.
+
+    A tap is correct when its description differs from that of the tap
+    before (the other button) and incorrect when it is the same; the
+    first tap only starts the sequence. Each tap is looked at once and
+    none are kept, the times between them go into RunningStats.
+    """
+
+    def __init__(self):
+        self.taps = 0
+        # Per hand (RIGHT, LEFT).
+        self.correct = [0, 0]
+        self.incorrect = [0, 0]
+        self.missing = 0
+        self.error_runs = 0
+        self.longest_error_run = 0
+        self.error_run = 0
+
+        self.intervals = RunningStats()
+        self.hand_intervals = (RunningStats(), RunningStats())
+        self.hand_moments = [None, None]
+        self.first_moment = None
+        self.last_moment = None
+        self.timed = 0
+
+        self.description = None
+        self.moment = None
+
+    def add(self, description, time):
+        """Count a tap with its ``description`` and ``time`` (an ISO-8601
+        string or None).
+        """
+        hand = tap_hand(description) if isinstance(description, str) else None
+        tapped = moment(time)
+
+        if self.taps:
+            if hand is None:
+                self.missing += 1
+            elif description != self.description:
+                self.correct[hand] += 1
+            else:
+                self.incorrect[hand] += 1
+
+            if description == self.description:
+                self.error_run += 1
+                if self.error_run == 1:
+                    self.error_runs += 1
+                if self.error_run > self.longest_error_run:
+                    self.longest_error_run = self.error_run
+            else:
+                self.error_run = 0
+
+            if tapped is not None and self.moment is not None:
+                self.intervals.add((tapped - self.moment).total_seconds())
+
+        if tapped is not None:
+            if self.first_moment is None:
+                self.first_moment = tapped
+            self.timed += 1
+            self.last_moment = tapped
+            if hand is not None:
+                previous = self.hand_moments[hand]
+                if previous is not None:
+                    self.hand_intervals[hand].add((tapped - previous).total_seconds())
+                self.hand_moments[hand] = tapped
+
+        self.taps += 1
+        self.description = description
+        self.moment = tapped
+
+    def columns(self):
+        """The TAPPING_COLUMNS and their values."""
+        intervals = self.intervals
+        taps_per_second = None
+        if self.timed > 1:
+            seconds = (self.last_moment - self.first_moment).total_seconds()
+            if seconds > 0:
+                taps_per_second = round((self.timed - 1) / seconds, 2)
+
+        values = [
+            self.correct[RIGHT],
+            self.correct[LEFT],
+            self.incorrect[RIGHT],
+            self.incorrect[LEFT],
+            self.missing,
+            self.taps,
+            self.error_runs,
+            self.longest_error_run,
+            _rounded(intervals.mean if intervals.count else None, 3),
+            _rounded(intervals.sd, 3),
+            _rounded(intervals.min, 3),
+            _rounded(intervals.max, 3),
+            taps_per_second,
+            _rounded(self.hand_intervals[RIGHT].cv, 3),
+            _rounded(self.hand_intervals[LEFT].cv, 3),
+        ]
+        return zip(TAPPING_COLUMNS, values)
+
+
+class RunningStats:
+    """The count, mean, standard deviation, minimum and maximum of a
+    series of numbers, updated a number at a time (Welford's algorithm).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self._squares = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._squares += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def sd(self):
+        """The sample standard deviation, or None for less than two numbers."""
+        if self.count < 2:
+            return None
+        return math.sqrt(self._squares / (self.count - 1))
+
+    @property
+    def cv(self):
+        """The coefficient of variation (sd / mean), or None."""
+        sd = self.sd
+        if sd is None or self.mean <= 0:
+            return None
+        return sd / self.mean
+
+
+def _rounded(value, digits):
+    return None if value is None else round(value, digits)
+
+
+@register('healthdata')
+def _process_healthdata(data, parsed_record):
+    """Fill in parsed_record and return the (file_key, row) pairs of the
+    per-day sums (healthdata-daily) and of the blocks (healthdata-per-day).
+    """
+    _process_timestamps(data, parsed_record)
+    results = data['results']
+
+    # if len(results) > 0:
+    #     field_names = list(results[0].keys())
+    #     for idx, sample in enumerate(results):
+    #         for field in field_names:
+    #             sample_key = 'sample_%s_%d' % (field, idx)
+    #             parsed_record[sample_key] = sample[field]
+
+
+    accumulator = {}
+    extra_rows = []
+
+    for block in results:
+        block_type = block["type"]
+        # Each timestamp is parsed once and reused below.
+        date_from = parse_timestamp(block["dateFrom"])
+        date_to = parse_timestamp(block["dateTo"])
+
+        extra_rows.append(('healthdata-per-day', {
+            'participant': parsed_record['participant'],
+            'timezone': parsed_record.get('timezone'),
+            'type': block_type.split(".")[-1],
+            'dateFrom': block["dateFrom"],
+            'dateTo': block["dateTo"],
+            'value': float(block["value"]),
+        }))
+
+        # Blocks spanning midnight are divided over the days they cover,
+        # in the timezone of the participant's device.
+        days = day_boundaries(participant_timezone(parsed_record.get('timezone'), block["dateFrom"]))
+        day_values = days.split(date_from.epoch, date_to.epoch, float(block["value"]))
+    
+        if block_type in accumulator:
+            for day, value in day_values:
+                if day in accumulator[block_type]["sum"]:
+                    accumulator[block_type]["sum"][day] += value
+                else:
+                    accumulator[block_type]["sum"][day] = value
+
+            # In case data is not ordered chronologically
+            if date_from.epoch < accumulator[block_type]["date_first"]:
+                accumulator[block_type]["date_first"] = date_from.epoch
+
+            if date_to.epoch > accumulator[block_type]["date_last"]:
+                accumulator[block_type]["date_last"] = date_to.epoch
+        else:
+            accumulator[block_type] = {
+                "sum": {},
+                "date_first": date_from.epoch,
+                "date_last": date_to.epoch
+            }
+            for day, value in day_values:
+                accumulator[block_type]['sum'][day] = accumulator[block_type]['sum'].get(day, 0.0) + value
+
+    for block_type_key, columns in HEALTHDATA_TYPE_COLUMNS.items():
+        try:
+            block_type = accumulator[block_type_key]
+        except KeyError:
+            block_type = None
+            pass
+        col_name, start_column, end_column, hours_column = columns
+
+        # Column 1: start date, in UTC with its offset so it does not
+        # depend on the timezone of the machine running the script.
+        if block_type:
+            start_time = block_type["date_first"]
+            start_time_iso = datetime.fromtimestamp(start_time, timezone.utc).isoformat()
+        else:
+            start_time_iso = None
+        parsed_record[start_column] = start_time_iso
+     
+        # Column 2: end date
+        if block_type:
+            end_time = block_type["date_last"]
+            end_time_iso = datetime.fromtimestamp(end_time, timezone.utc).isoformat()
+        else:
+            end_time_iso = None
+        parsed_record[end_column] = end_time_iso
+        
+        # Column 3: number of hours between Start_Time and End_Time
+        if block_type:
+            time_diff = block_type["date_last"] - block_type["date_first"]
+            unit = 3600 # 1 hour
+            diff_as_nr = int(time_diff / unit) + (time_diff % unit) / unit
+            time_diff = round(diff_as_nr, 2)
+        else:
+            time_diff = None
+        parsed_record[hours_column] = time_diff
+
+        # The sum per day goes to the long healthdata-daily table, one
+        # row per date, rather than into a single encoded cell.
+        if block_type:
+            for date_from in block_type['sum']:
+                extra_rows.append(('healthdata-daily', {
+                    'id': parsed_record['id'],
+                    'participant': parsed_record['participant'],
+                    'type': col_name,
+                    'Date_as_Number': date_from,
+                    'value': block_type['sum'][date_from],
+                    'Session_Start_Time': start_time_iso,
+                    'Session_End_Time': end_time_iso,
+                    'Hours_Range': time_diff,
+                }))
+
+    # print(parsed_record)
+    return extra_rows
@@ -0,0 +1,140 @@
+
+#
+# Incremental writers for the qc-responses-1nP-<file_key>.csv files.
+#
+# Each file is opened the first time its file_key is seen and rows are
+# written as soon as they are produced, so memory use depends on the
+# number of open files rather than on the number of records.
+#
+# Files whose file_key is in ``append`` (incremental runs) are extended
+# instead of replaced.
+#
+# Rows are written as the values of the columns of the header, in the
+# same order, so a row always lines up with the header whatever keys its
+# dict has or misses. Rows of qc1np.rows.row_type() already are those
+# values and are written as they are.
+#
+
+import csv
+import os
+
+from qc1np.schemas import TRAILING_COLUMNS, columns_for
+
+# The CSV should quote all non-numeric fields and escape the
+# delimiter when it appears inside a quoted field.
+CSVARGS = {
+    'strict': True,
+    'quotechar': '"',
+    'delimiter': ',',
+    'quoting': csv.QUOTE_ALL,
+    'doublequote': False,
+    'escapechar': '\\',
+    'skipinitialspace': True,
+}
+
+FILENAME_PATTERN = 'qc-responses-1nP-%s.csv'
+
+
+class CsvWriterPool:
+    """One CSV writer per file_key, opened on first use."""
+
+    def __init__(self, directory='', log=None, append=()):
+        self.directory = directory
+        self.log = log
+        self.append = append
+        self.filenames = {}
+        self.rows = {}
+        self._files = {}
+        self._writers = {}
+        self._columns = {}
+        self._buffers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, file_key, row):
+        if file_key not in self.filenames:
+            self._open(file_key)
+        self.rows[file_key] += 1
+
+        # Without a fixed schema the header can only be known once all
+        # rows have been seen, so those (small) datasets are kept until
+        # the pool is closed.
+        if file_key in self._buffers:
+            self._buffers[file_key].append(row)
+            return
+
+        if isinstance(row, dict):
+            row = list(map(row.get, self._columns[file_key]))
+        self._writers[file_key].writerow(row)
+
+    def close(self):
+        for file_key, rows in self._buffers.items():
+            filename = self.filenames[file_key]
+            if file_key in self.append and os.path.exists(filename):
+                with open(filename, newline='') as csvfile:
+                    rows = list(csv.DictReader(csvfile, **CSVARGS)) + rows
+
+            column_names = list(dict.fromkeys(
+                key for row in rows for key in row if key not in TRAILING_COLUMNS
+            ))
+            column_names.extend(TRAILING_COLUMNS)
+            self._start(file_key, column_names, 'w')
+            self._writers[file_key].writerows(list(map(row.get, column_names)) for row in rows)
+        self._buffers = {}
+
+        for csvfile in self._files.values():
+            csvfile.close()
+        self._files = {}
+        self._writers = {}
+
+    def _open(self, file_key):
+        filename = os.path.join(self.directory, FILENAME_PATTERN % file_key)
+        self.filenames[file_key] = filename
+        self.rows[file_key] = 0
+        self._log('\nWriting file (%d) %s' % (len(self.filenames), filename))
+
+        column_names = columns_for(file_key)
+        if column_names is None:
+            self._buffers[file_key] = []
+        elif file_key in self.append and os.path.exists(filename):
+            with open(filename, newline='') as csvfile:
+                header = next(csv.reader(csvfile, **CSVARGS), None)
+            if header != list(column_names):
+                raise ValueError(
+                    'The columns of %s do not match the current schema; '
+                    'reprocess the full export' % filename
+                )
+            self._start(file_key, column_names, 'a')
+        else:
+            self._start(file_key, column_names, 'w')
+
+    def _start(self, file_key, column_names, mode):
+        # Create a new file and file handle for each dataset and start
+        # with the header row unless rows are appended.
+        csvfile = open(self.filenames[file_key], mode, newline='')
+        ghostwriter = csv.writer(csvfile, **CSVARGS)
+        if mode == 'w':
+            ghostwriter.writerow(column_names)
+        self._files[file_key] = csvfile
+        self._writers[file_key] = ghostwriter
+        self._columns[file_key] = tuple(column_names)
+
+    def _log(self, message):
+        if self.log is not None:
+            self.log(message)
+
+
+def truncate_rows(filename, rows):
+    """Keep the header and the first ``rows`` rows of ``filename``."""
+    partial = filename + '.partial'
+    with open(filename, newline='') as csvfile, open(partial, 'w', newline='') as outfile:
+        reader = csv.reader(csvfile, **CSVARGS)
+        ghostwriter = csv.writer(outfile, **CSVARGS)
+        ghostwriter.writerow(next(reader))
+        for _, row in zip(range(rows), reader):
+            ghostwriter.writerow(row)
+    os.replace(partial, filename)
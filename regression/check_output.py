@@ -0,0 +1,284 @@
+#
+# Regression check of the CSV files written by the hotfix script.
+#
+# Two exports are built from benchmarks/synthetic_export.py with a fixed
+# seed:
+#
+#   sample  plain synthetic records of every activity
+#   edge    synthetic records plus hand-made ones: an intake with and
+#           one without the symptoms list, an empty final questionnaire,
+#           a Stroop response without interactions, one whose first
+#           and fourth interactions have no description and a tapping
+#           response created before the records around it
+#
+# The response ids are UUID strings, as in the real exports.
+#
+# Each export is transformed with one process and with --workers 2, and
+# every qc-responses-1nP-*.csv file must be byte for byte equal to the
+# one under regression/golden/<export>/. Refactorings of the script that
+# should not change its output are checked with this.
+#
+# The single process run also writes the Parquet datasets (--parquet).
+# The Stroop sessions with their interactions (qc1np.stroop.wide_view())
+# must then have the same values whether the notebook loads them from
+# the CSV files, from the Parquet datasets or with transform_export().
+# This needs pandas and pyarrow.
+#
+# Usage:
+#
+#   $ python3 regression/check_output.py
+#   $ python3 regression/check_output.py --update   # after an intended change
+#
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+sys.path.insert(0, ROOT)
+
+import pandas as pd  # noqa: E402
+
+from qc1np.frames import transform_export  # noqa: E402
+from qc1np.participants import REGISTRY_PATH, ParticipantRegistry  # noqa: E402
+from qc1np.schemas import COLUMN_TYPES, GESTURES  # noqa: E402
+from qc1np.stroop import wide_view  # noqa: E402
+from synthetic_export import generate  # noqa: E402
+
+SCRIPT = os.path.join(ROOT, 'hotfix-1np-responses-20210317.py')
+GOLDEN = os.path.join(HERE, 'golden')
+CSV_PATTERN = 'qc-responses-1nP-*.csv'
+STROOP = 'task-at_stroopeffect'
+STROOP_INTERACTIONS = 'task-at_stroopeffect-interactions'
+
+HEALTH_BLOCKS = 20
+
+
+def sample_export():
+    return list(generate(300, seed=0, health_blocks=HEALTH_BLOCKS))
+
+
+def edge_export():
+    records = list(generate(200, seed=3, health_blocks=HEALTH_BLOCKS))
+    study = records[0]['study']
+    first = records[0]['participant_id']
+    second = records[1]['participant_id']
+    timestamps = {
+        'start': '2021-03-17T23:30:00+01:00',
+        'end': '2021-03-17T23:40:00+01:00',
+        'scheduled_start': '2021-03-17T00:00:00+01:00',
+        'scheduled_end': '2021-03-17T23:59:00+01:00',
+        'submitted': '2021-03-17T23:41:00+01:00',
+    }
+
+    def answer(text):
+        return {'results': {'answer': [{'text': text}]}}
+
+    def record(record_id, participant, response_type, activity, created_at, results, start=None):
+        metadata = {
+            'activity': {'short_name': activity},
+            'app': {'version': '1.4.2', 'build': '118', 'device': {'tz': 'Europe/Amsterdam'}},
+        }
+        data = {
+            'timestamps': dict(timestamps, start=start) if start else timestamps,
+            'results': results,
+        }
+        return {
+            'id': record_id,
+            'participant_id': participant,
+            'response_type': response_type,
+            'study': study,
+            'metadata': json.dumps(metadata),
+            'created_at': created_at,
+            'data': json.dumps(data),
+        }
+
+    records.append(record('00000000-0000-4000-8000-000000009001', first, 1, 'qes_intake', '2021-03-18T00:00:00+00:00', {
+        'Basic Demographic Information': {'results': {'age': answer('33'), 'sex': answer('F')}},
+    }))
+    records.append(record('00000000-0000-4000-8000-000000009002', second, 1, 'qes_intake', '2021-03-18T00:00:01+00:00', {
+        'Basic Demographic Information': {'results': {'age': answer('41')}},
+        'symptoms_list': {'results': {'headache': answer('Yes')}},
+    }))
+    records.append(record('00000000-0000-4000-8000-000000009003', first, 1, 'qes_final', '2021-03-18T00:00:02+00:00', {}))
+    records.append(record('00000000-0000-4000-8000-000000009004', first, 2, 'at_stroopeffect', '2021-03-18T00:00:03+00:00', {}))
+    records.append(record('00000000-0000-4000-8000-000000009006', second, 2, 'at_stroopeffect', '2021-03-18T00:00:04+00:00', {
+        'at_stroopeffect': {'interactions': [
+            {'time': '2021-03-17T23:30:01+01:00', 'correctness': 'Correct gesture'},
+            {'time': '2021-03-17T23:30:02+01:00', 'correctness': 'Correct gesture',
+             'description': 'Word shown in Red with spelling Blue, total words 2'},
+            {'time': '2021-03-17T23:30:03+01:00', 'correctness': 'Wrong gesture',
+             'description': 'Word shown in Green with spelling Green, total words 3'},
+            {'time': '2021-03-17T23:30:05+01:00', 'correctness': 'Correct gesture', 'description': ''},
+        ]},
+    }))
+    records.insert(5, record('00000000-0000-4000-8000-000000009005', first, 2, 'at_tapping', '2021-03-16T00:00:03+00:00', {
+        'at_tapping': {'interactions': [
+            {'time': '2021-03-16T10:00:01+01:00', 'description': 'Tapped right button'},
+            {'time': '2021-03-16T10:00:02+01:00', 'description': 'Tapped right button'},
+            {'time': '2021-03-16T10:00:03+01:00', 'description': 'Tapped left button'},
+        ]},
+    }, start='2021-03-16T10:00:00+01:00'))
+    return records
+
+
+EXPORTS = {
+    'sample': sample_export,
+    'edge': edge_export,
+}
+
+
+def run_script(records, directory, *options):
+    """Write ``records`` as an export in ``directory`` and transform it
+    there; returns the paths of the CSV files written.
+    """
+    export = os.path.join(directory, 'export.json')
+    with open(export, 'w') as outfile:
+        json.dump(records, outfile)
+    subprocess.run(
+        [sys.executable, SCRIPT, export] + list(options),
+        cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True,
+    )
+    return sorted(glob.glob(os.path.join(directory, CSV_PATTERN)))
+
+
+def compare_loaders(name, directory, records):
+    """The differences between wide_view() of the Stroop sessions loaded
+    from the CSV files and from the other sources, as the notebook loads
+    them.
+    """
+    def load(source):
+        return pd.read_csv(os.path.join(directory, source % 'csv'))
+
+    def read(source):
+        return pd.read_parquet(os.path.join(directory, source % 'parquet'))
+
+    # The tracebacks and messages of the records that do not parse, as
+    # the script's.
+    with contextlib.redirect_stderr(io.StringIO()), contextlib.redirect_stdout(io.StringIO()):
+        frames = transform_export(
+            io.StringIO(json.dumps(records)),
+            ParticipantRegistry(os.path.join(directory, REGISTRY_PATH), legacy_path=None),
+        )
+    views = {
+        'CSV': wide_view(load('qc-responses-1nP-%s.%%s' % STROOP), load('qc-responses-1nP-%s.%%s' % STROOP_INTERACTIONS)),
+        'Parquet': wide_view(read('qc-responses-1nP-%s.%%s' % STROOP), read('qc-responses-1nP-%s.%%s' % STROOP_INTERACTIONS)),
+        'transform_export()': wide_view(frames[STROOP], frames[STROOP_INTERACTIONS]),
+    }
+
+    problems = []
+    expected = _values(views.pop('CSV'))
+    for source, view in views.items():
+        actual = _values(view)
+        if actual[0] != expected[0]:
+            problems.append('%s: the Stroop columns from %s differ from the CSV' % (name, source))
+        elif len(actual[1]) != len(expected[1]):
+            problems.append('%s: %s has %d Stroop sessions instead of %d' % (
+                name, source, len(actual[1]), len(expected[1]),
+            ))
+        else:
+            for number, (left, right) in enumerate(zip(expected[1], actual[1]), 1):
+                if left != right:
+                    column = next(c for c, l, r in zip(expected[0], left, right) if l != r)
+                    problems.append('%s: Stroop session %d from %s differs from the CSV in %s' % (
+                        name, number, source, column,
+                    ))
+                    break
+    return problems
+
+
+def _values(frame):
+    # The column names and rows of ``frame`` as Python values of the type
+    # of each column, None when missing, whatever the dtypes.
+    columns = []
+    for name in frame.columns:
+        values = frame[name].astype(object)
+        kind = COLUMN_TYPES.get(re.sub(r'^Inter\d+_', '', name), 'string')
+        if kind == 'timestamp':
+            values = pd.to_datetime(values, utc=True, format='ISO8601', errors='coerce').astype(object)
+        elif kind in ('int', 'float'):
+            values = pd.to_numeric(values, errors='coerce').astype(float).astype(object)
+        elif kind == 'gesture':
+            values = values.map(lambda value: GESTURES.get(value) if isinstance(value, str) else value)
+        else:
+            values = values.map(lambda value: value if pd.isna(value) else str(value))
+        columns.append([None if pd.isna(value) else value for value in values])
+    return list(frame.columns), list(zip(*columns))
+
+
+def compare(name, golden, written):
+    """The differences between the golden files and the written ones."""
+    problems = []
+    expected = {os.path.basename(path): path for path in glob.glob(os.path.join(golden, CSV_PATTERN))}
+    actual = {os.path.basename(path): path for path in written}
+
+    for filename in sorted(expected.keys() - actual.keys()):
+        problems.append('%s: %s was not written' % (name, filename))
+    for filename in sorted(actual.keys() - expected.keys()):
+        problems.append('%s: %s is not in %s' % (name, filename, golden))
+
+    for filename in sorted(expected.keys() & actual.keys()):
+        with open(expected[filename], 'rb') as infile:
+            expected_lines = infile.read().splitlines()
+        with open(actual[filename], 'rb') as infile:
+            actual_lines = infile.read().splitlines()
+        if expected_lines == actual_lines:
+            continue
+        for number, (left, right) in enumerate(zip(expected_lines, actual_lines), 1):
+            if left != right:
+                problems.append('%s: %s differs from line %d' % (name, filename, number))
+                break
+        else:
+            problems.append('%s: %s has %d lines instead of %d' % (
+                name, filename, len(actual_lines), len(expected_lines),
+            ))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the output of the hotfix script with the golden files.')
+    parser.add_argument('--update', action='store_true', help='rewrite the golden files from the current output')
+    args = parser.parse_args()
+
+    problems = []
+    for name, export in EXPORTS.items():
+        records = export()
+        golden = os.path.join(GOLDEN, name)
+
+        with tempfile.TemporaryDirectory() as directory:
+            written = run_script(records, directory, '--parquet')
+            problems.extend(compare_loaders(name, directory, records))
+            if args.update:
+                shutil.rmtree(golden, ignore_errors=True)
+                os.makedirs(golden)
+                for path in written:
+                    shutil.copy(path, golden)
+                print('Updated %s (%d files)' % (golden, len(written)))
+                continue
+            problems.extend(compare(name, golden, written))
+
+        with tempfile.TemporaryDirectory() as directory:
+            written = run_script(records, directory, '--workers', '2')
+            problems.extend(compare('%s --workers 2' % name, golden, written))
+
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+    if not args.update:
+        print('The output matches the golden files')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#
+# Checks of the shared Participant_NR registry (qc1np.participants).
+#
+# Runs with pytest or on its own:
+#
+#   $ python3 regression/test_participants.py
+#
+
+import json
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from qc1np.participants import ParticipantRegistry  # noqa: E402
+
+
+def _journal(path):
+    with open(path) as infile:
+        return [json.loads(line) for line in infile]
+
+
+def test_two_registries_on_one_journal():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ppt_id_to_ppt_nr.jsonl')
+        a = ParticipantRegistry(path, legacy_path=None)
+        b = ParticipantRegistry(path, legacy_path=None)
+
+        assert a.number('p1') == 1
+        assert b.number('p2') == 2
+        # Numbered by the other registry, not again.
+        assert b.number('p1') == 1
+        assert list(a.assign(pd.Series(['p2', 'p3', 'p2']))) == [2, 3, 2]
+        assert b.number('p3') == 3
+
+        assert _journal(path) == [
+            {'participant': 'p1', 'number': 1},
+            {'participant': 'p2', 'number': 2},
+            {'participant': 'p3', 'number': 3},
+        ]
+        assert ParticipantRegistry(path, legacy_path=None).numbers == {'p1': 1, 'p2': 2, 'p3': 3}
+
+
+def test_partial_last_line_is_dropped():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ppt_id_to_ppt_nr.jsonl')
+        with open(path, 'w') as outfile:
+            outfile.write('{"participant": "p1", "number": 1}\n{"participant": "p2", "nu')
+
+        registry = ParticipantRegistry(path, legacy_path=None)
+        assert registry.numbers == {'p1': 1}
+        assert registry.number('p2') == 2
+        assert _journal(path) == [
+            {'participant': 'p1', 'number': 1},
+            {'participant': 'p2', 'number': 2},
+        ]
+
+
+if __name__ == '__main__':
+    for name, function in list(globals().items()):
+        if name.startswith('test_'):
+            function()
+            print('%s passed' % name)